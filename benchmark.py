@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+'''
+Headless benchmark of the qtinteract update path.
+
+Builds SimpleWindow, FitTool and IShow instances of different sizes, drives their
+sliders and draggable lines through scripted trajectories and reports the
+end-to-end latency of every step, the throughput and the peak memory as JSON:
+
+    python benchmark.py --out before.json
+    python benchmark.py --baseline before.json --tolerance 0.2   # exit code 1 on a regression
+
+It also checks that `import qtinteract` stays within --import-budget seconds.
+'''
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import sys
+import json
+import inspect
+import platform
+import argparse
+import tracemalloc
+from time import perf_counter
+from itertools import product
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+
+app = QApplication.instance() or QApplication([])
+
+import qtinteract as qi
+from test_import import measure_import
+
+TIMEOUT = 10.      # seconds to wait for a single step to reach the screen
+
+
+
+def make_func(j, nparams):
+    names = [f'p{k}' for k in range(nparams)]
+    def f(x, **p):
+        y = np.full_like(x, float(j))
+        for k, name in enumerate(names):
+            y += p[name] * np.sin((k+1)*x)
+        return y
+    f.__signature__ = inspect.Signature(
+        [inspect.Parameter('x', inspect.Parameter.POSITIONAL_OR_KEYWORD)] +
+        [inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=1.) for name in names])
+    return f
+
+
+def busy(w):
+    scheduler = getattr(w, 'scheduler', None)
+    if scheduler is not None and scheduler.pending:
+        return True
+    for ev in (getattr(w, 'evaluator', None), getattr(w, 'fitter', None)):
+        if ev is not None and (ev.running is not None or ev.pending is not None):
+            return True
+    return w.perf.current is not None
+
+
+def wait_idle(w, timeout=TIMEOUT):
+    t0 = perf_counter()
+    while True:
+        app.processEvents()
+        if not busy(w):
+            return True
+        if perf_counter() - t0 > timeout:
+            return False
+
+
+def slider_trajectory(w, kind, steps, seed=0):
+    '''
+    Yields (name, slider position) pairs:
+    sweep -- the first parameter back and forth over its whole range,
+    round-robin -- every parameter in turn,
+    random -- random jumps of random parameters (defeats the cache).
+    '''
+    rng = np.random.default_rng(seed)
+    names = w.param_names
+    for s in range(steps):
+        if kind == 'sweep':
+            name = names[0]
+        elif kind == 'round-robin':
+            name = names[s % len(names)]
+        elif kind == 'random':
+            name = names[rng.integers(len(names))]
+        else:
+            raise ValueError(f'Supported trajectories: "sweep", "round-robin", "random", got {kind}')
+        n = w.limits[name].nsteps
+        if kind == 'random':
+            k = int(rng.integers(n+1))
+        elif kind == 'round-robin':
+            k = (w.limits[name].v2k(w.get_param(name)) + 1) % (n+1)
+        else:
+            k = s % (2*n) if n > 0 else 0
+            k = k if k <= n else 2*n - k
+        yield name, k
+
+
+def line_trajectory(lo, hi, steps):
+    # from hi towards the middle and back
+    mid = (lo + hi) / 2
+    for s in range(steps):
+        t = abs((s % 40) - 20) / 20
+        yield mid + (hi - mid) * t
+
+
+def drive(w, moves):
+    '''
+    Applies the moves (callables) one by one, waiting for every one of them to
+    be evaluated and painted. Returns the per-step latencies in ms.
+    '''
+    latencies = []
+    ntimeouts = 0
+    for move in moves:
+        t0 = perf_counter()
+        move()
+        if not wait_idle(w):
+            ntimeouts += 1
+        latencies.append((perf_counter() - t0) * 1e3)
+    return latencies, ntimeouts
+
+
+def summarize(latencies, ntimeouts, elapsed, w):
+    lat = np.array(latencies)
+    perf = w.perf.stats()
+    return {
+        'steps': len(lat),
+        'timeouts': ntimeouts,
+        'latency_p50': float(np.percentile(lat, 50)) if len(lat) else None,
+        'latency_p95': float(np.percentile(lat, 95)) if len(lat) else None,
+        'latency_max': float(lat.max()) if len(lat) else None,
+        'throughput': len(lat) / elapsed if elapsed > 0 else None,
+        'perf': {k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in perf.items()},
+    }
+
+
+def run_case(name, params, build, moves):
+    tracemalloc.start()
+    try:
+        t0 = perf_counter()
+        w = build()
+        w.show()
+        wait_idle(w)
+        build_time = perf_counter() - t0
+        w.perf.records.clear()
+        t0 = perf_counter()
+        latencies, ntimeouts = drive(w, moves(w))
+        elapsed = perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        result = {'case': name, 'params': params, 'build_s': build_time}
+        result.update(summarize(latencies, ntimeouts, elapsed, w))
+        result['peak_mb'] = peak / 2**20
+        w.close()
+        w.deleteLater()
+        app.processEvents()
+        return result
+    finally:
+        tracemalloc.stop()
+
+
+def bench_simple(npoints, ncurves, nparams, trajectory, execution, steps):
+    x = np.linspace(0, 10, npoints)
+    def build():
+        funcs = [make_func(j, nparams) for j in range(ncurves)]
+        w = qi.SimpleWindow(x, funcs, **{f'p{k}': (0., 5.) for k in range(nparams)})
+        w.set_execution(execution)
+        return w
+    def moves(w):
+        for name, k in slider_trajectory(w, trajectory, steps):
+            def move(name=name, k=k):
+                w.create_param_row(name)     # large windows only create the rows scrolled into view
+                getattr(w, name+'_slider').setValue(k)
+            yield move
+    return run_case('SimpleWindow',
+                    {'points': npoints, 'curves': ncurves, 'params': nparams,
+                     'trajectory': trajectory, 'execution': execution},
+                    build, moves)
+
+
+def bench_fit(npoints, nparams, steps):
+    x = np.linspace(0, 10, npoints)
+    f = make_func(0, nparams)
+    rng = np.random.default_rng(0)
+    data = f(x, **{f'p{k}': 1. + k/nparams for k in range(nparams)}) + rng.normal(0, 0.1, npoints)
+    def build():
+        return qi.FitTool(x, [data, f], ['.', '-'], **{f'p{k}': (0., 5.) for k in range(nparams)})
+    def moves(w):
+        for v in line_trajectory(x[0], x[-1], steps):
+            def move(v=v):
+                w.line2.setValue(v)
+                w.line2.sigDragged.emit(w.line2)
+            yield move
+    return run_case('FitTool', {'points': npoints, 'params': nparams}, build, moves)
+
+
+def bench_image(size, band, steps):
+    rng = np.random.default_rng(0)
+    im = rng.random((size, size))
+    def build():
+        s = qi.IShow(im)
+        s.set_band(band)
+        return s
+    def moves(s):
+        for j, v in enumerate(line_trajectory(0, size-1, steps)):
+            line = s.hline if j % 2 else s.vline
+            def move(line=line, v=v):
+                line.setPos(v)
+                line.sigDragged.emit(line)
+            yield move
+    return run_case('IShow', {'size': size, 'band': band}, build, moves)
+
+
+def check_import(budget, repeat=5):
+    '''
+    The checks of test_import.py (import time on top of PyQt5 and pyqtgraph,
+    no scipy, no pyqtgraph config changes) as a part of the report.
+    '''
+    r = measure_import(repeat)
+    problems = []
+    if r['seconds'] > budget:
+        problems.append(f'import takes {r["seconds"]*1e3:.1f} ms, the budget is {budget*1e3:.1f} ms')
+    if r['scipy']:
+        problems.append('scipy is imported at import time')
+    if r['config_changed']:
+        problems.append('pyqtgraph config is changed at import time')
+    return {'seconds': r['seconds'], 'budget': budget, 'problems': problems}
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Returns the cases whose median latency grew by more than tolerance
+    (a fraction) relative to the baseline run.
+    '''
+    def key(r):
+        return r['case'], json.dumps(r['params'], sort_keys=True)
+    base = {key(r): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None or not b['latency_p50'] or r['latency_p50'] is None:
+            continue
+        ratio = r['latency_p50'] / b['latency_p50']
+        if ratio > 1 + tolerance:
+            regressions.append({'case': r['case'], 'params': r['params'],
+                                'baseline_p50': b['latency_p50'], 'latency_p50': r['latency_p50'],
+                                'ratio': ratio})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, nargs='*', default=[1000, 100000])
+    parser.add_argument('--curves', type=int, nargs='*', default=[1, 4])
+    parser.add_argument('--params', type=int, nargs='*', default=[2, 8])
+    parser.add_argument('--trajectory', nargs='*', default=['sweep', 'random'],
+                        choices=['sweep', 'round-robin', 'random'])
+    parser.add_argument('--execution', nargs='*', default=['sync'], choices=['sync', 'thread', 'process'])
+    parser.add_argument('--fit-points', type=int, nargs='*', default=[1000, 10000])
+    parser.add_argument('--image', type=int, nargs='*', default=[512, 2048])
+    parser.add_argument('--band', type=int, nargs='*', default=[1, 16])
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--out', help='write the results to this file instead of stdout')
+    parser.add_argument('--baseline', help='results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative growth of the median latency (default: 0.2)')
+    parser.add_argument('--import-budget', type=float, default=0.05,
+                        help='max seconds for `import qtinteract` on top of PyQt5 and pyqtgraph (default: 0.05)')
+    args = parser.parse_args(argv)
+
+    import_check = check_import(args.import_budget)
+    for problem in import_check['problems']:
+        print(f'import check failed: {problem}', file=sys.stderr)
+    results = []
+    for npoints, ncurves, nparams, trajectory, execution in product(
+            args.points, args.curves, args.params, args.trajectory, args.execution):
+        results.append(bench_simple(npoints, ncurves, nparams, trajectory, execution, args.steps))
+        print(f'SimpleWindow {npoints=} {ncurves=} {nparams=} {trajectory} {execution}: '
+              f'p50 {results[-1]["latency_p50"]:.2f} ms', file=sys.stderr)
+    for npoints, nparams in product(args.fit_points, args.params):
+        results.append(bench_fit(npoints, nparams, args.steps))
+        print(f'FitTool {npoints=} {nparams=}: p50 {results[-1]["latency_p50"]:.2f} ms', file=sys.stderr)
+    for size, band in product(args.image, args.band):
+        results.append(bench_image(size, band, args.steps))
+        print(f'IShow {size=} {band=}: p50 {results[-1]["latency_p50"]:.2f} ms', file=sys.stderr)
+
+    report = {
+        'qtinteract': qi.__version__,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pyqtgraph': qi.pg.__version__,
+        'platform': platform.platform(),
+        'import': import_check,
+        'results': results,
+    }
+    status = 1 if import_check['problems'] else 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+        if report['regressions']:
+            status = 1
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,30 +1,75 @@
+import os
+import csv
+import hashlib
+import tempfile
+import shutil
+import atexit
+import uuid
+import weakref
 from traceback import print_exc
-from math import pi
+from math import pi, ceil
+from time import perf_counter
+from itertools import product
+from collections import OrderedDict, deque
+from threading import Lock, Thread, Event
+import queue
 import inspect
+import pickle
+import multiprocessing
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dataclasses import dataclass
 
 import numpy as np
-from scipy.optimize import curve_fit
 
 from PyQt5.QtWidgets import QWidget, QLabel, QSlider, QDoubleSpinBox, QVBoxLayout, \
-     QGridLayout, QPushButton, QHBoxLayout, QTabWidget, QLineEdit
-from PyQt5.QtCore import Qt
+     QGridLayout, QPushButton, QHBoxLayout, QTabWidget, QLineEdit, QSpinBox, QCheckBox, \
+     QToolButton, QScrollArea
+from PyQt5.QtCore import Qt, QObject, QTimer, QRectF, pyqtSignal
+from PyQt5.QtGui import QOpenGLContext, QImage, QPainter
 import pyqtgraph
 import pyqtgraph as pg
 from PyQt5 import QtWidgets
 
 __version__ = '0.2'
 
-try:
-    ipython = get_ipython()
-    ipython.run_line_magic('gui', 'qt')
-except:
-    pass
-
-pg.setConfigOptions(antialias=True)
-pg.setConfigOption('background', 'w')
-pg.setConfigOption('foreground', 'k')
-pg.setConfigOption('imageAxisOrder', 'row-major')
+_setup_done = False
+
+def setup(ipython_gui=False):
+    '''
+    Global setup: pyqtgraph config options, applied once, on the first window
+    creation. With ipython_gui=True it also enables the qt event loop
+    integration of IPython (%gui qt); call it explicitly for that, before or
+    after the first window.
+    '''
+    global _setup_done
+    if ipython_gui:
+        try:
+            ipython = get_ipython()
+            ipython.run_line_magic('gui', 'qt')
+        except:
+            pass
+    if _setup_done:
+        return
+    _setup_done = True
+    pg.setConfigOptions(antialias=True)
+    pg.setConfigOption('background', 'w')
+    pg.setConfigOption('foreground', 'k')
+    pg.setConfigOption('imageAxisOrder', 'row-major')
+
+def curve_fit(*args, **kwargs):
+    from scipy.optimize import curve_fit     # scipy is slow to import, only load it for fitting
+    return curve_fit(*args, **kwargs)
+
+_fusion_style = None
+
+def fusion_style():
+    # one style object shared by all the parameter widgets
+    global _fusion_style
+    if _fusion_style is None:
+        _fusion_style = QtWidgets.QStyleFactory.create('Fusion')
+    return _fusion_style
 
 def set_value_nc(objs, v):
     if not isinstance(objs, (list, tuple)):
@@ -40,6 +85,15 @@ def spin2slider(v, vmin, vmax, n):
 #def slider2spin(x, vmin, vmax):
 #    return vmin + (x/100)*(vmax-vmin)
 
+def param_grid(**values):
+    '''
+    All combinations of the parameter values as a list of dicts:
+    param_grid(a=[1, 2], b=[0, 1]) -> [{'a': 1, 'b': 0}, {'a': 1, 'b': 1}, {'a': 2, 'b': 0}, ...]
+    '''
+    names = list(values)
+    return [dict(zip(names, combo)) for combo in product(*values.values())]
+
+
 @dataclass
 class Limits:
     vmin: float
@@ -57,7 +111,1151 @@ class Limits:
         return round((v-self.vmin)/(self.vmax-self.vmin)*self.nsteps)
 
 
+def _nbytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    try:
+        return np.asarray(value).nbytes
+    except:
+        return 0
+
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache limited by the total nbytes of the values.
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.data:
+                self._remove(key)
+            self.data[key] = value
+            self.sizes[key] = size
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self.data)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        del self.data[key]
+        self.nbytes -= self.sizes.pop(key)
+
+    def invalidate(self, pred=None):
+        with self.lock:
+            keys = [key for key in self.data if pred is None or pred(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.data),
+            'nbytes': self.nbytes,
+        }
+
+
+class SweepTable:
+    '''
+    Values of a function precomputed over the full Limits range of one or two
+    parameters: table[k0, (k1,) :] = func(x, **params). Each parameter becomes an
+    extra array axis of a single broadcasted call, evaluated in chunks along the
+    first axis to keep the temporaries under chunk_bytes.
+    '''
+    def __init__(self, func, x, names, limits, fixed, max_bytes=256*2**20, chunk_bytes=16*2**20):
+        self.func = func
+        self.names = list(names)
+        self.limits = [Limits(lim.vmin, lim.vmax, lim.vstep) for lim in limits]
+        self.fixed = dict(fixed)
+        self.grids = [lim.k2v(np.arange(lim.nsteps+1)) for lim in self.limits]
+        shape = tuple(len(grid) for grid in self.grids) + (len(x),)
+        if np.prod(shape)*8 > max_bytes:
+            raise ValueError(f'Sweep table of shape {shape} exceeds the memory budget of {max_bytes} bytes')
+        ndim = len(shape)
+        step = max(1, chunk_bytes // (int(np.prod(shape[1:]))*8))
+        self.table = None
+        for j in range(0, shape[0], step):
+            kw = dict(fixed)
+            for axis, (name, grid) in enumerate(zip(self.names, self.grids)):
+                if axis == 0:
+                    grid = grid[j:j+step]
+                kw[name] = grid.reshape((-1,) + (1,)*(ndim-1-axis))
+            y = np.asarray(func(x, **kw))
+            if self.table is None:
+                self.table = np.empty(shape, dtype=y.dtype)
+            self.table[j:j+step] = np.broadcast_to(y, self.table[j:j+step].shape)
+
+    def matches(self, func, fixed, limits):
+        return func is self.func and fixed == self.fixed and list(limits) == self.limits
+
+    def __getitem__(self, ks):
+        return self.table[tuple(ks)]
+
+
+def minmax_indices(y, i0, i1, nbuckets):
+    '''
+    Indices of the minimum and the maximum of y[i0:i1] in each of nbuckets
+    equal-count buckets, in ascending order.
+    '''
+    size = -(-(i1-i0) // nbuckets)
+    if size <= 2:
+        return np.arange(i0, i1)
+    n = (i1-i0) // size * size
+    blocks = y[i0:i0+n].reshape(-1, size)
+    starts = np.arange(i0, i0+n, size)
+    imin, imax = blocks.argmin(axis=1) + starts, blocks.argmax(axis=1) + starts
+    if i0+n < i1:
+        tail = y[i0+n:i1]
+        imin = np.append(imin, tail.argmin() + i0+n)
+        imax = np.append(imax, tail.argmax() + i0+n)
+    idx = np.stack([imin, imax], axis=1)
+    idx.sort(axis=1)
+    return idx.ravel()
+
+
+class MinMaxPyramid:
+    '''
+    Indices of the minima and the maxima of a static curve over blocks of
+    2**base, 2**(base+1), ... points, so that any range of it can be decimated
+    without scanning the raw data.
+    '''
+    def __init__(self, y, base=3, min_blocks=256):
+        self.base = base
+        self.levels = []
+        dtype = np.int32 if len(y) < 2**31 else np.int64
+        imin = minmax_indices(y, 0, len(y), -(-len(y) // 2**base))
+        imin, imax = imin[0::2].astype(dtype), imin[1::2].astype(dtype)
+        # minmax_indices returns the pair sorted by position, not by value
+        swap = y[imin] > y[imax]
+        imin[swap], imax[swap] = imax[swap], imin[swap]
+        self.levels.append((imin, imax))
+        while len(imin) > min_blocks:
+            m = len(imin) // 2 * 2
+            a, b = imin[0:m:2], imin[1:m:2]
+            imin_ = np.where(y[a] <= y[b], a, b)
+            a, b = imax[0:m:2], imax[1:m:2]
+            imax_ = np.where(y[a] >= y[b], a, b)
+            if m < len(imin):
+                imin_, imax_ = np.append(imin_, imin[-1]), np.append(imax_, imax[-1])
+            imin, imax = imin_, imax_
+            self.levels.append((imin, imax))
+
+    def query(self, i0, i1, nbuckets):
+        '''
+        Indices to draw y[i0:i1] with at least nbuckets min/max pairs, or None
+        if the range is too short for the pyramid.
+        '''
+        for j in range(len(self.levels)-1, -1, -1):
+            shift = self.base + j
+            if (i1-i0) >> shift >= nbuckets:
+                imin, imax = self.levels[j]
+                b0, b1 = i0 >> shift, ((i1-1) >> shift) + 1
+                idx = np.stack([imin[b0:b1], imax[b0:b1]], axis=1)
+                idx.sort(axis=1)
+                return idx.ravel()
+        return None
+
+
+def set_draft_style(plots, symbols_to_pen=True):
+    '''
+    Switches the curves to the cheapest rendering while the user drags something:
+    no antialiasing, no symbols (symbol-only curves get a plain pen instead unless
+    symbols_to_pen is False). Returns the saved styles for restore_style.
+    '''
+    saved = {}
+    for p in plots:
+        saved[p] = {k: p.opts[k] for k in ('pen', 'symbol', 'antialias')}
+        draft = {'antialias': False, 'symbol': None}
+        if symbols_to_pen and p.opts['symbol'] is not None and p.opts['pen'] is None:
+            draft['pen'] = pg.mkPen(p.opts['symbolPen'])
+        p.opts.update(draft)
+        p.updateItems(styleUpdate=True)
+    return saved
+
+def restore_style(saved):
+    for p, opts in saved.items():
+        p.opts.update(opts)
+        p.updateItems(styleUpdate=True)
+
+
+def opengl_available():
+    return QOpenGLContext().create()
+
+
+class RingBuffer:
+    '''
+    Preallocated buffer of the last length (x, y) samples. Every sample is
+    stored twice, so that the window is always one contiguous slice. Thread-safe:
+    extend() is called by the ingest thread, read() by the GUI.
+    '''
+    def __init__(self, length):
+        self.length = length
+        self.x = np.zeros(2*length)
+        self.y = np.zeros(2*length)
+        self.out_x = np.zeros(length)      # what read() returns, owned by the GUI thread
+        self.out_y = np.zeros(length)
+        self.start = 0       # index of the oldest sample
+        self.size = 0
+        self.count = 0       # number of samples ever received, the default x
+        self.version = 0
+        self.lock = Lock()
+
+    def extend(self, x, y):
+        y = np.asarray(y, dtype=np.float64).ravel()
+        n = len(y)
+        with self.lock:
+            if x is None:
+                x = np.arange(self.count, self.count + n, dtype=np.float64)
+            else:
+                x = np.broadcast_to(np.asarray(x, dtype=np.float64).ravel(), (n,))
+            self.count += n
+            if n > self.length:
+                x, y = x[-self.length:], y[-self.length:]
+                n = self.length
+            L = self.length
+            pos = (self.start + self.size) % L
+            k = min(n, L - pos)
+            for buf, v in ((self.x, x), (self.y, y)):
+                buf[pos:pos+k] = v[:k]
+                buf[pos+L:pos+L+k] = v[:k]
+                buf[:n-k] = v[k:]
+                buf[L:L+n-k] = v[k:]
+            self.size += n
+            if self.size > L:
+                self.start = (self.start + self.size - L) % L
+                self.size = L
+            self.version += 1
+
+    def read(self):
+        with self.lock:
+            n, s = self.size, self.start
+            self.out_x[:n] = self.x[s:s+n]
+            self.out_y[:n] = self.y[s:s+n]
+        return self.out_x[:n], self.out_y[:n]
+
+
+class StreamSource:
+    '''
+    Live data for iplot. Samples can be pushed from any thread (e.g. from an
+    instrument callback) as y, (x, y) or arrays of either; the window shows the
+    last length of them. A generator or a queue.Queue passed as source is
+    read by a background thread.
+    '''
+    def __init__(self, source=None, length=10000):
+        self.source = source
+        self.buffer = RingBuffer(length)
+        self.thread = None
+        self.stopped = Event()
+
+    def push(self, item):
+        if isinstance(item, tuple) and len(item) == 2:
+            self.buffer.extend(*item)
+        else:
+            self.buffer.extend(None, item)
+
+    def start(self):
+        if self.source is None or self.thread is not None:
+            return
+        self.thread = Thread(target=self.run, daemon=True, name='qtinteract-stream')
+        self.thread.start()
+
+    def run(self):
+        try:
+            if isinstance(self.source, queue.Queue):
+                while not self.stopped.is_set():
+                    try:
+                        self.push(self.source.get(timeout=0.1))
+                    except queue.Empty:
+                        pass
+            else:
+                for item in self.source:
+                    if self.stopped.is_set():
+                        break
+                    self.push(item)
+        except:
+            print_exc()
+
+    def stop(self):
+        self.stopped.set()
+
+
+@dataclass
+class Coarse:
+    '''
+    A result evaluated on every stride-th point only, shown while a slider is held.
+    '''
+    x: np.ndarray
+    y: np.ndarray
+    stride: int
+
+
+class UpdateScheduler(QObject):
+    '''
+    Coalesces parameter change events: the latest value of each parameter wins,
+    intermediate values are dropped, and the callback is called at most once
+    per event loop iteration and at most max_rate times per second.
+    '''
+    def __init__(self, callback, max_rate=60, parent=None):
+        super().__init__(parent)
+        self.callback = callback
+        self.max_rate = max_rate
+        self.pending = {}
+        self.last_flush = 0.
+        self.nevents = 0
+        self.ndropped = 0
+        self.nflushes = 0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def request(self, name, value):
+        self.nevents += 1
+        if name in self.pending:
+            self.ndropped += 1
+        self.pending[name] = value
+        if not self.timer.isActive():
+            delay = 0
+            if self.max_rate:
+                delay = max(0., 1/self.max_rate - (perf_counter() - self.last_flush))
+            self.timer.start(round(delay*1000))
+
+    def flush(self):
+        self.timer.stop()
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        self.last_flush = perf_counter()
+        self.nflushes += 1
+        try:
+            self.callback(pending)
+        except:
+            print_exc()
+
+    def cancel(self):
+        self.timer.stop()
+        self.ndropped += len(self.pending)
+        self.pending = {}
+
+    def stats(self):
+        return {
+            'events': self.nevents,
+            'dropped': self.ndropped,
+            'updates': self.nflushes,
+        }
+
+
+class AsyncEvaluator(QObject):
+    '''
+    Runs func in a worker thread and passes the result to callback on the GUI
+    thread. Every request gets a generation number; only the result of the latest
+    generation is delivered, the superseded ones are thrown away.
+    '''
+    done = pyqtSignal(int, object)
+
+    def __init__(self, func, callback, parent=None):
+        super().__init__(parent)
+        self.func = func
+        self.callback = callback
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qtinteract')
+        self.generation = 0
+        self.running = None
+        self.pending = None
+        self.nsuperseded = 0
+        self.done.connect(self.on_done)
+
+    def submit(self, *args):
+        self.generation += 1
+        if self.pending is not None:
+            self.nsuperseded += 1
+        self.pending = (self.generation, args)
+        if self.running is None:
+            self.start_pending()
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def supersede(self):
+        self.generation += 1
+        self.pending = None
+
+    def start_pending(self):
+        generation, args = self.pending
+        self.pending = None
+        self.running = self.pool.submit(self.run, generation, args)
+
+    def run(self, generation, args):
+        result = None
+        try:
+            if self.is_current(generation):
+                result = self.func(*args)
+        except:
+            print_exc()
+        self.done.emit(generation, result)
+
+    def on_done(self, generation, result):
+        self.running = None
+        if result is not None:
+            if self.is_current(generation):
+                self.callback(result)
+            else:
+                self.nsuperseded += 1
+        if self.pending is not None:
+            self.start_pending()
+
+    def shutdown(self):
+        self.pending = None
+        self.generation += 1
+        self.pool.shutdown(wait=False)
+
+
+class FitCancelled(Exception):
+    pass
+
+
+class AsyncFitter(AsyncEvaluator):
+    '''
+    Runs curve_fit in a worker thread. A new request cancels the fit in flight:
+    the model raises FitCancelled as soon as it sees that its generation is stale.
+    Intermediate parameter estimates are reported to on_progress at most every
+    progress_interval seconds.
+    '''
+    progress = pyqtSignal(int, object)
+
+    def __init__(self, callback, on_progress, progress_interval=0.05, parent=None):
+        super().__init__(self.fit, callback, parent=parent)
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.ncancelled = 0
+        self.progress.connect(self.progress_received)
+
+    def run(self, generation, args):
+        result = None
+        try:
+            if self.is_current(generation):
+                result = self.fit(generation, *args)
+        except FitCancelled:
+            self.ncancelled += 1
+        except:
+            print_exc()
+        self.done.emit(generation, result)
+
+    def fit(self, generation, f, names, x, y, p0):
+        last = [perf_counter()]
+        def model(x, *p):
+            if not self.is_current(generation):
+                raise FitCancelled()
+            now = perf_counter()
+            if now - last[0] > self.progress_interval:
+                last[0] = now
+                self.progress.emit(generation, np.array(p))
+            return f(x, **dict(zip(names, p)))
+        p, _ = curve_fit(model, x, y, p0=p0)
+        return p
+
+    def progress_received(self, generation, p):
+        if self.is_current(generation):
+            self.on_progress(p)
+
+
+def _fit_rows(f, names, x, rows, ys, p0):
+    def model(x, *p):
+        return f(x, **dict(zip(names, p)))
+    out = []
+    for row, y in zip(rows, ys):
+        try:
+            p, _ = curve_fit(model, x, y, p0=p0)
+            chi2 = float(np.sum((model(x, *p) - y)**2))
+            out.append((row, p, True, chi2, ''))
+        except Exception as e:
+            out.append((row, np.full(len(names), np.nan), False, np.nan, str(e)))
+    return out
+
+
+class BatchFitter(QObject):
+    '''
+    Fits func to every row of a 2D array on a process pool (falls back to a
+    thread pool if func cannot be sent to worker processes). Results are
+    collected into a structured array with one field per parameter plus
+    'success', 'chi2' and 'message'.
+    '''
+    chunk_done = pyqtSignal(object)
+    progress = pyqtSignal(int, int)      # rows done, total
+    finished = pyqtSignal(object)
+
+    def __init__(self, func, names, x, ys, p0, chunk=16, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.args = (func, list(names), x)
+        self.ys = ys
+        self.p0 = list(p0)
+        self.chunk = chunk
+        self.max_workers = max_workers
+        dtype = [(name, 'f8') for name in names] + [('success', '?'), ('chi2', 'f8'), ('message', 'U80')]
+        self.results = np.zeros(len(ys), dtype=dtype)
+        for name in names:
+            self.results[name] = np.nan
+        self.results['chi2'] = np.nan
+        self.ndone = 0
+        self.pool = None
+        self.futures = []
+        # queued, so that a pool restart never happens in the middle of start()
+        self.chunk_done.connect(self.on_chunk_done, Qt.QueuedConnection)
+
+    def start(self, processes=True):
+        if processes:
+            try:
+                context = multiprocessing.get_context('fork')
+            except ValueError:
+                context = None
+            self.pool = ProcessPoolExecutor(self.max_workers, mp_context=context)
+        else:
+            self.pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='qtinteract-fit')
+        self.processes = processes
+        todo = np.flatnonzero(self.results['message'] == '')
+        todo = todo[~self.results['success'][todo]]
+        for i in range(0, len(todo), self.chunk):
+            rows = todo[i:i+self.chunk]
+            future = self.pool.submit(_fit_rows, *self.args, rows, self.ys[rows], self.p0)
+            self.futures.append(future)      # before the callback: it runs at once if the chunk is done
+            future.add_done_callback(self.chunk_done.emit)
+
+    def on_chunk_done(self, future):
+        if future.cancelled() or future not in self.futures:
+            return
+        try:
+            out = future.result()
+        except Exception as e:
+            if self.processes:
+                print(f'Process pool failed ({e!r}), fitting in threads')
+                self.cancel()
+                self.start(processes=False)
+            else:
+                print_exc()
+            return
+        for row, p, success, chi2, message in out:
+            for name, v in zip(self.args[1], p):
+                self.results[name][row] = v
+            self.results['success'][row] = success
+            self.results['chi2'][row] = chi2
+            self.results['message'][row] = message[:80] if message or success else 'failed'
+        self.ndone += len(out)
+        self.progress.emit(self.ndone, len(self.ys))
+        if self.ndone == len(self.ys):
+            self.pool.shutdown(wait=False)
+            self.finished.emit(self.results)
+
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+
+class SharedArray(np.ndarray):
+    '''
+    An array in a shared memory block; keeps the block mapped while it is alive.
+    '''
+    pass
+
+
+_worker = {}     # state of a ProcessBackend worker process
+
+def _init_worker(funcs, funcs_x):
+    _worker['funcs'] = funcs
+    _worker['funcs_x'] = funcs_x
+    _worker['func_out'] = ['out' in inspect.signature(f).parameters for f in funcs]
+    _worker['blocks'] = {}
+
+def _compute_in_worker(i, kw, block=None, shape=None, dtype=None, stride=None):
+    f, x = _worker['funcs'][i], _worker['funcs_x'][i]
+    if stride is not None:
+        x = x[::stride]
+    out = None
+    if block is not None:
+        shm = _worker['blocks'].get(block)
+        if shm is None:
+            shm = _worker['blocks'][block] = SharedMemory(name=block)
+        out = np.ndarray(shape, dtype, buffer=shm.buf)
+    elif _worker['func_out'][i] and x is not None:
+        out = np.empty(np.shape(x))
+    if out is not None and _worker['func_out'][i]:
+        kw = dict(kw, out=out)
+    y = f(**kw) if x is None else f(x, **kw)
+    if block is None:
+        return out if y is None else y
+    if y is None or y is out:      # written into the block
+        return None
+    y = np.asarray(y)
+    if y.shape != out.shape:
+        return y         # does not fit the block, send it the usual way
+    out[...] = y
+    return None
+
+def _compute_frame_in_worker(kws):
+    return [np.asarray(_compute_in_worker(i, kw)) for i, kw in kws]
+
+
+class ProcessBackend:
+    '''
+    Evaluates the functions of a window in persistent worker processes. The
+    functions and x arrays are loaded into the workers once; results are written
+    into shared memory blocks allocated by the window, so only the parameter
+    values are pickled. Replacing a function restarts the workers.
+    '''
+    def __init__(self, funcs, funcs_x, max_workers=None):
+        self.funcs = list(funcs)
+        self.funcs_x = list(funcs_x)
+        self.max_workers = max_workers
+        self.shms = []
+        self.nrestarts = 0
+        self.pool = None
+        self.start()
+
+    def start(self):
+        try:
+            context = multiprocessing.get_context('fork')
+            resource_tracker.ensure_running()    # shared with the workers, which attach to the blocks
+        except ValueError:       # no fork: the functions have to be picklable
+            context = None
+            pickle.dumps(self.funcs)
+        self.pool = ProcessPoolExecutor(self.max_workers, mp_context=context,
+                                        initializer=_init_worker, initargs=(self.funcs, self.funcs_x))
+
+    def register(self, funcs):
+        if len(funcs) == len(self.funcs) and all(f is g for f, g in zip(funcs, self.funcs)):
+            return
+        self.funcs = list(funcs)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.nrestarts += 1
+        self.start()
+
+    def allocate(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        shm = SharedMemory(create=True, size=max(int(np.prod(shape))*dtype.itemsize, 1))
+        self.shms.append(shm)
+        out = np.ndarray(shape, dtype, buffer=shm.buf).view(SharedArray)
+        out.shm = shm
+        return out
+
+    def compute(self, i, kw, out=None, stride=None):
+        if not isinstance(out, SharedArray):
+            return self.pool.submit(_compute_in_worker, i, kw, stride=stride).result()
+        y = self.pool.submit(_compute_in_worker, i, kw, out.shm.name, out.shape, out.dtype.str).result()
+        return out if y is None else y
+
+    def submit_frame(self, kws):
+        # all the functions for one set of parameters, results sent back by pickling
+        return self.pool.submit(_compute_frame_in_worker, kws)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for shm in self.shms:
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.shms = []
+
+
+class ChunkedEvaluator:
+    '''
+    Evaluates elementwise functions over contiguous slices of x in a thread pool
+    (numpy releases the GIL), every slice writing into its part of one output
+    array. The chunk size of each function is tuned by trying larger and
+    smaller chunks now and then and keeping the fastest per point.
+    '''
+    def __init__(self, max_workers=None, min_chunk=2**14, explore_every=8):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_chunk = min_chunk
+        self.explore_every = explore_every
+        self.pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='qtinteract-chunk')
+        self.tuning = {}     # key -> [chunk, best chunk, best seconds per point, factor, calls to wait]
+        self.lock = Lock()
+
+    def chunk_range(self, n):
+        return self.min_chunk, max(self.min_chunk, ceil(n / self.max_workers))
+
+    def chunk_size(self, key, n):
+        lo, hi = self.chunk_range(n)
+        with self.lock:
+            if key not in self.tuning:
+                self.tuning[key] = [hi, hi, None, 0.5, 0]     # start with one slice per worker
+            return min(max(self.tuning[key][0], lo), hi)
+
+    def tune(self, key, n, chunk, t):
+        lo, hi = self.chunk_range(n)
+        with self.lock:
+            st = self.tuning[key]
+            _, best, best_t, factor, wait = st
+            if chunk == best:
+                best_t = t if best_t is None else (best_t + t) / 2
+            elif t < best_t * 0.95:
+                best, best_t = chunk, t              # better: keep going in this direction
+            else:
+                factor, wait = 1/factor, self.explore_every
+            if wait > 0:
+                st[:] = [best, best, best_t, factor, wait-1]
+                return
+            nxt = min(max(round(best*factor), lo), hi)
+            if nxt == best:
+                factor = 1/factor
+                nxt = min(max(round(best*factor), lo), hi)
+            st[:] = [nxt, best, best_t, factor, 0]
+
+    def compute(self, key, f, x, kw, out=None, func_out=False):
+        n = len(x)
+        chunk = self.chunk_size(key, n)
+        t0 = perf_counter()
+        start = 0
+        if out is None and func_out:
+            out = np.empty(n)
+        elif out is None:    # the first slice tells the dtype
+            y = np.asarray(f(x[:chunk], **kw))
+            out = np.empty((n,) + y.shape[1:], y.dtype)
+            out[:chunk] = y
+            start = chunk
+        def run(j0, j1):
+            if func_out:
+                f(x[j0:j1], out=out[j0:j1], **kw)
+            else:
+                out[j0:j1] = f(x[j0:j1], **kw)
+        futures = [self.pool.submit(run, j, min(j+chunk, n)) for j in range(start, n, chunk)]
+        for future in futures:
+            future.result()
+        self.tune(key, n, chunk, (perf_counter() - t0) / n)
+        return out
+
+    def forget(self, key):
+        with self.lock:
+            self.tuning.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {key: {'chunk': st[0], 'best_chunk': st[1], 'best_ns_per_point': st[2] and st[2]*1e9}
+                    for key, st in self.tuning.items()}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+class Prefetcher(QObject):
+    '''
+    When the window is idle, evaluates the steps adjacent to the current position
+    of the most recently moved parameter and puts the results into the window cache.
+    The radius grows with the drag speed; any real update cancels the prefetch.
+    '''
+    def __init__(self, window, min_radius=1, max_radius=16, lookahead=0.25, idle_ms=30, parent=None):
+        super().__init__(parent)
+        self.window = window
+        self.min_radius = min_radius
+        self.max_radius = max_radius
+        self.lookahead = lookahead     # seconds of dragging to prefetch ahead
+        self.idle_ms = idle_ms
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qtinteract-prefetch')
+        self.generation = 0
+        self.futures = []
+        self.name = None
+        self.last = None
+        self.speed = 0.                # steps per second
+        self.direction = 1
+        self.nprefetched = 0
+        self.ncancelled = 0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.start)
+
+    @property
+    def radius(self):
+        r = ceil(self.speed * self.lookahead)
+        return min(max(r, self.min_radius), self.max_radius)
+
+    def moved(self, name, k):
+        self.cancel()
+        now = perf_counter()
+        if name == self.name and self.last is not None:
+            t, k0 = self.last
+            if now > t and k != k0:
+                self.speed = 0.5*self.speed + 0.5*abs(k-k0)/(now-t)
+                self.direction = 1 if k > k0 else -1
+        else:
+            self.speed = 0.
+        self.name = name
+        self.last = (now, k)
+
+    def schedule(self):
+        if self.name is not None:
+            self.timer.start(self.idle_ms)
+
+    def cancel(self):
+        self.generation += 1
+        self.timer.stop()
+        for future in self.futures:
+            if future.cancel():
+                self.ncancelled += 1
+        self.futures = []
+
+    def offsets(self):
+        for d in range(1, self.radius+1):
+            yield d*self.direction
+            yield -d*self.direction
+
+    def start(self):
+        try:
+            w = self.window
+            name = self.name
+            if name not in w.limits or name in w.sweep_names:
+                return
+            if any(player.playing for player in w.players.values()):
+                return
+            current = w.current_params()
+            k0 = w.param_key(name, current[name])
+            if k0 is None:
+                return
+            lim = w.limits[name]
+            funcs = w.param_deps[name]
+            for d in self.offsets():
+                if 0 <= k0+d <= lim.nsteps:
+                    params = dict(current)
+                    params[name] = lim.k2v(k0+d)
+                    self.futures.append(self.pool.submit(self.run, self.generation, funcs, params))
+        except:
+            print_exc()
+
+    def run(self, generation, funcs, params):
+        w = self.window
+        try:
+            for i in funcs:
+                if generation != self.generation:
+                    return
+                if w.fill_cache(i, params):
+                    self.nprefetched += 1
+        except:
+            print_exc()
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'prefetched': self.nprefetched,
+            'cancelled': self.ncancelled,
+            'radius': self.radius,
+            'speed': self.speed,
+        }
+
+
+class Player(QObject):
+    '''
+    Steps a parameter through its Limits at a target frame rate. When the window
+    cannot keep up, frames are skipped according to the measured evaluation and
+    render time; the upcoming frames are precomputed into the window cache by a
+    background worker.
+    '''
+    def __init__(self, window, name, fps=25, lookahead=8, parent=None):
+        super().__init__(parent)
+        self.window = window
+        self.name = name
+        self.fps = fps
+        self.lookahead = lookahead
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qtinteract-play')
+        self.futures = {}        # slider position -> precompute task
+        self.costs = deque(maxlen=10)      # seconds from frame request to setData
+        self.eval_costs = deque(maxlen=10) # seconds to precompute a frame
+        self.shown = deque(maxlen=50)      # timestamps of the frames shown
+        self.requested = None
+        self.nframes = 0
+        self.nskipped = 0
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.tick)
+
+    @property
+    def playing(self):
+        return self.timer.isActive()
+
+    @property
+    def achieved_fps(self):
+        if len(self.shown) < 2 or self.shown[-1] == self.shown[0]:
+            return 0.
+        return (len(self.shown)-1) / (self.shown[-1] - self.shown[0])
+
+    def play(self):
+        self.shown.clear()
+        self.requested = None
+        self.timer.start(round(1000/self.fps))
+
+    def pause(self):
+        self.timer.stop()
+        self.cancel()
+        self.requested = None
+
+    def cancel(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+
+    def step(self, nsteps):
+        # never a whole turn: the slider would stay where it is
+        cost = max([float(np.median(c)) for c in (self.costs, self.eval_costs) if c], default=0.)
+        return min(max(1, round(cost*self.fps)), max(nsteps, 1))
+
+    def tick(self):
+        try:
+            if self.requested is not None:     # previous frame is still being computed
+                self.nskipped += 1
+                return
+            w = self.window
+            nsteps = w.limits[self.name].nsteps
+            slider = getattr(w, self.name+'_slider')
+            step = self.step(nsteps)
+            k = (slider.value() + step) % (nsteps + 1)
+            if k in self.futures and not self.futures[k].done():
+                return                         # wait for the background worker
+            self.nskipped += step - 1
+            self.requested = perf_counter()
+            if k == slider.value():            # a single position: no valueChanged to wait for
+                w.frame_shown()
+                return
+            slider.setValue(k)
+            w.scheduler.flush()
+            self.precompute(k, step)
+        except:
+            print_exc()
+
+    def frame_shown(self):
+        if self.requested is None:
+            return
+        now = perf_counter()
+        self.costs.append(now - self.requested)
+        self.requested = None
+        self.shown.append(now)
+        self.nframes += 1
+
+    def precompute(self, k, step):
+        w = self.window
+        if w.cache is None or self.name in w.sweep_names or w.execution == 'sync':
+            return
+        lim = w.limits[self.name]
+        ahead = [(k + j*step) % (lim.nsteps + 1) for j in range(1, self.lookahead+1)]
+        for kj in list(self.futures):
+            if kj not in ahead or self.futures[kj].done():
+                self.futures.pop(kj).cancel()
+        current = w.current_params()
+        funcs = w.param_deps[self.name]
+        for kj in ahead:
+            if kj not in self.futures:
+                params = dict(current)
+                params[self.name] = lim.k2v(kj)
+                self.futures[kj] = self.pool.submit(self.run, funcs, params)
+
+    def run(self, funcs, params):
+        try:
+            t0 = perf_counter()
+            if any([self.window.fill_cache(i, params) for i in funcs]):
+                self.eval_costs.append(perf_counter() - t0)
+        except:
+            print_exc()
+
+    def shutdown(self):
+        self.pause()
+        self.pool.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'target_fps': self.fps,
+            'achieved_fps': self.achieved_fps,
+            'frames': self.nframes,
+            'skipped': self.nskipped,
+        }
+
+
+class PerfMonitor(QObject):
+    '''
+    Records the timings of every update of a window -- event received, evaluation
+    start and end (also per function), setData and paint complete -- into a ring
+    buffer. Optionally shows a p50/p95 latency and fps overlay on the canvas.
+    '''
+    fields = ('t_event', 't_eval_start', 't_eval_end', 't_setdata', 't_paint')
+
+    def __init__(self, canvas, size=1000, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.records = deque(maxlen=size)
+        self.t_event = None      # first input event not yet picked up by an update
+        self.current = None      # the update waiting for setData/paint
+        self.callbacks = []
+        self.files = []
+        self.hud = None
+        self.hud_timer = None
+        paint_event = canvas.paintEvent
+        def wrapped(event):
+            paint_event(event)
+            self.painted()
+        canvas.paintEvent = wrapped
+
+    def event_received(self):
+        if self.t_event is None:
+            self.t_event = perf_counter()
+
+    def discard_event(self):
+        # the input did not lead to an update, don't charge its time to the next one
+        self.t_event = None
+
+    def begin(self):
+        self.finish()
+        now = perf_counter()
+        rec = dict.fromkeys(self.fields, np.nan)
+        rec['t_event'] = now if self.t_event is None else self.t_event
+        rec['funcs'] = []      # (i, start, end) for every evaluated function
+        self.t_event = None
+        self.current = rec
+        return rec
+
+    def set_data_done(self):
+        if self.current is not None:
+            self.current['t_setdata'] = perf_counter()
+
+    def painted(self):
+        rec = self.current
+        if rec is not None and not np.isnan(rec['t_setdata']):
+            rec['t_paint'] = perf_counter()
+            self.finish()
+
+    def finish(self):
+        rec, self.current = self.current, None
+        if rec is None or np.isnan(rec['t_setdata']):
+            return         # superseded before it reached the screen
+        self.records.append(rec)
+        for callback in self.callbacks:
+            try:
+                callback(rec)
+            except:
+                print_exc()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def log_csv(self, path):
+        f = open(path, 'w', newline='')
+        writer = csv.writer(f)
+        writer.writerow(self.fields + ('funcs',))
+        def write(rec):
+            funcs = ' '.join(f'f{i}:{(t1-t0)*1e3:.3f}' for i, t0, t1 in rec['funcs'])
+            writer.writerow([rec[k] for k in self.fields] + [funcs])
+            f.flush()
+        self.files.append(f)
+        self.add_callback(write)
+        return write
+
+    def stats(self):
+        recs = list(self.records)
+        if not recs:
+            return {'n': 0}
+        t = {k: np.array([r[k] for r in recs]) for k in self.fields}
+        shown = np.where(np.isnan(t['t_paint']), t['t_setdata'], t['t_paint'])
+        def pct(v):
+            v = v[~np.isnan(v)] * 1e3
+            if len(v) == 0:
+                return np.nan, np.nan
+            return tuple(np.percentile(v, [50, 95]).tolist())
+        st = {'n': len(recs)}
+        for name, v in (('latency', shown - t['t_event']),
+                        ('eval', t['t_eval_end'] - t['t_eval_start']),
+                        ('setdata', t['t_setdata'] - t['t_eval_end']),
+                        ('paint', t['t_paint'] - t['t_setdata'])):
+            st[name+'_p50'], st[name+'_p95'] = pct(v)
+        recent = shown[shown > shown[-1] - 2.]    # frame rate over the last two seconds
+        st['fps'] = float((len(recent)-1) / (recent[-1] - recent[0])) if recent[-1] > recent[0] else 0.
+        return st
+
+    def show_hud(self, on=True):
+        if on and self.hud is None:
+            self.hud = pg.LabelItem(justify='left', color='k', size='8pt')
+            self.hud.setParentItem(self.canvas.getPlotItem().getViewBox())
+            self.hud.anchor(itemPos=(0, 0), parentPos=(0, 0), offset=(5, 5))
+            self.hud_timer = QTimer(self)
+            self.hud_timer.timeout.connect(self.update_hud)
+        if self.hud is not None:
+            self.hud.setVisible(on)
+            if on:
+                self.update_hud()
+                self.hud_timer.start(250)
+            else:
+                self.hud_timer.stop()
+
+    def update_hud(self):
+        st = self.stats()
+        if st['n'] == 0:
+            self.hud.setText('no updates yet')
+        else:
+            self.hud.setText(f'latency p50 {st["latency_p50"]:.1f} ms, p95 {st["latency_p95"]:.1f} ms, '
+                             f'{st["fps"]:.0f} fps')
+
+    def close(self):
+        if self.hud_timer is not None:
+            self.hud_timer.stop()
+        for f in self.files:
+            f.close()
+        self.files = []
+
+
 class SimpleWindow(QWidget):
+    max_rate = 60          # max number of updates per second, None for unlimited
+    execution = 'sync'     # 'sync': evaluate on the GUI thread, 'thread': in a worker thread,
+                           # 'process': in worker processes
+    cache_bytes = 256*2**20    # memory budget of the result cache, 0 to disable
+    prefetch = True        # in 'thread'/'process' mode, evaluate neighbouring slider steps in the background when idle
+    sweep_bytes = 256*2**20    # memory budget of a precomputed sweep table
+    decimate_threshold = 20000    # curves longer than this are min/max decimated to the view, None to disable
+    param_panel_threshold = 30    # with more parameters, they are shown in a scrollable list with a filter
+    param_panel_rows = 10  # number of rows visible in that list
+    chunked = False        # evaluate elementwise functions over slices of x in a thread pool
+    progressive = False    # while a slider is held, evaluate on every n-th point of x only
+    latency_target = 0.03  # seconds per update the coarse evaluation aims at
+    refine_delay = 300     # ms of a held slider not moving before the full resolution is computed
+    draft_quality = True   # no antialiasing and no symbols while a slider or a line is dragged
+    opengl = False         # draw the plot through OpenGL: True, False or 'auto' (when painting is slow)
+    opengl_threshold = 0.02    # 'auto': median paint time in seconds above which OpenGL is tried
+    stream_length = 10000  # number of samples of a streaming source kept on screen
+    stream_rate = 30       # redraws per second of the streaming sources
+    perf_size = 1000       # number of updates kept by the latency monitor
+
     def add_param(self, name, vmin=None, vmax=None, vstep=None, v=None):
         if vstep is None:
             if any(isinstance(var, float) for var in (vmin, vmax, vstep, v)):
@@ -75,58 +1273,190 @@ class SimpleWindow(QWidget):
         assert vstep != 0
         lim = Limits(vmin, vmax, vstep)
         self.limits[name] = lim
-        n = lim.nsteps
+        self.param_index[name] = len(self.param_names)
+        self.param_names.append(name)
+        self.state = np.append(self.state, float(v))
+        if self.param_scroll is not None:
+            self.grid.setRowMinimumHeight(self.param_index[name], self.row_height)
+            self.filter_params(self.param_filter.text())
+        elif self.param_panel_built:
+            self.create_param_row(name)
+
+    def create_param_row(self, name):
+        if name in self.param_rows:
+            return
+        lim = self.limits[name]
+        vmin, vmax, vstep, n = lim.vmin, lim.vmax, lim.vstep, lim.nsteps
+        v = self.get_param(name)
+        style = fusion_style()
         label = QLabel(text=name)
         slider = QSlider()
-        slider.setStyle(QtWidgets.QStyleFactory.create('Fusion'))
+        slider.setStyle(style)
         slider.setOrientation(Qt.Horizontal)
         slider.setRange(0, n)
         slider.setValue(spin2slider(v, vmin, vmax, n))
         setattr(self, name+'_slider', slider)
         spinbox = QDoubleSpinBox()
-        spinbox.setStyle(QtWidgets.QStyleFactory.create('Fusion'))
+        spinbox.setStyle(style)
         spinbox.setRange(vmin, vmax)
         spinbox.setSingleStep(vstep)
         spinbox.setValue(v)
         setattr(self, name+'_spinbox', spinbox)
-        spinbox_min = QLineEdit()
-        spinbox_min.setStyle(QtWidgets.QStyleFactory.create('Fusion'))
-        spinbox_min.setText(str(vmin))
-        spinbox_min.setMaximumWidth(75)
-        setattr(self, name+'_spinbox_min', spinbox_min)
-        spinbox_max = QLineEdit()
-        spinbox_max.setStyle(QtWidgets.QStyleFactory.create('Fusion'))
-        spinbox_max.setText(str(vmax))
-        spinbox_max.setMaximumWidth(75)
-        setattr(self, name+'_spinbox_max', spinbox_max)
-        spinbox_step = QLineEdit()
-        spinbox_step.setStyle(QtWidgets.QStyleFactory.create('Fusion'))
-        spinbox_step.setText(str(vstep))
-        spinbox_step.setMaximumWidth(75)
-        setattr(self, name+'_spinbox_step', spinbox_step)
+        expand_button = QToolButton()
+        expand_button.setArrowType(Qt.RightArrow)
+        expand_button.setCheckable(True)
+        expand_button.setToolTip('min/max/step')
+        expand_button.toggled.connect(self.expand_clicked(name))
+        setattr(self, name+'_expand', expand_button)
+        play_button = QPushButton()
+        play_button.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaPlay))
+        play_button.setMaximumWidth(30)
+        play_button.setToolTip('Play/pause')
+        play_button.clicked.connect(self.play_clicked(name))
+        setattr(self, name+'_play', play_button)
+        fps_label = QLabel()
+        setattr(self, name+'_fps', fps_label)
         slider.valueChanged['int'].connect(self.slider_changed(name, spinbox)) # type: ignore
+        slider.sliderPressed.connect(self.slider_pressed)
+        slider.sliderReleased.connect(self.slider_released)
         spinbox.valueChanged['double'].connect(self.spinbox_changed(name, slider)) # type: ignore
-        spinbox_min.editingFinished.connect(self.spinbox_min_changed(spinbox_min, name, slider, spinbox)) # type: ignore
-        spinbox_max.editingFinished.connect(self.spinbox_max_changed(spinbox_max, name, slider, spinbox)) # type: ignore
-        spinbox_step.editingFinished.connect(self.spinbox_step_changed(spinbox_step, name, slider, spinbox)) # type: ignore
-        self.grid.addWidget(label, self.grid_row, 0, 1, 1)
-        self.grid.addWidget(slider, self.grid_row, 2, 1, 1)
-        self.grid.addWidget(spinbox, self.grid_row, 3, 1, 1)
-        self.grid.addWidget(QLabel('min:'), self.grid_row, 4, 1, 1)
-        self.grid.addWidget(spinbox_min, self.grid_row, 5, 1, 1)
-        self.grid.addWidget(QLabel('max:'), self.grid_row, 6, 1, 1)
-        self.grid.addWidget(spinbox_max, self.grid_row, 7, 1, 1)
-        self.grid.addWidget(QLabel('step:'), self.grid_row, 8, 1, 1)
-        self.grid.addWidget(spinbox_step, self.grid_row, 9, 1, 1)
-        self.grid_row += 1
-        self.param_names.append(name)
+        row = self.param_index[name]
+        self.grid.addWidget(label, row, 0, 1, 1)
+        self.grid.addWidget(play_button, row, 1, 1, 1)
+        self.grid.addWidget(slider, row, 2, 1, 1)
+        self.grid.addWidget(spinbox, row, 3, 1, 1)
+        self.grid.addWidget(expand_button, row, 4, 1, 1)
+        self.grid.addWidget(fps_label, row, 11, 1, 1)
+        self.param_rows[name] = [label, play_button, slider, spinbox, expand_button, fps_label]
+
+    def expand_param(self, name, on=True):
+        # the min/max/step editors are only created when a row is expanded for the first time
+        self.create_param_row(name)
+        expand_button = getattr(self, name+'_expand')
+        if expand_button.isChecked() != on:
+            expand_button.setChecked(on)     # calls back here through expand_clicked
+            return
+        if on and name not in self.param_editors:
+            lim = self.limits[name]
+            style = fusion_style()
+            slider = getattr(self, name+'_slider')
+            spinbox = getattr(self, name+'_spinbox')
+            spinbox_min = QLineEdit()
+            spinbox_min.setStyle(style)
+            spinbox_min.setText(str(lim.vmin))
+            spinbox_min.setMaximumWidth(75)
+            setattr(self, name+'_spinbox_min', spinbox_min)
+            spinbox_max = QLineEdit()
+            spinbox_max.setStyle(style)
+            spinbox_max.setText(str(lim.vmax))
+            spinbox_max.setMaximumWidth(75)
+            setattr(self, name+'_spinbox_max', spinbox_max)
+            spinbox_step = QLineEdit()
+            spinbox_step.setStyle(style)
+            spinbox_step.setText(str(lim.vstep))
+            spinbox_step.setMaximumWidth(75)
+            setattr(self, name+'_spinbox_step', spinbox_step)
+            spinbox_min.editingFinished.connect(self.spinbox_min_changed(spinbox_min, name, slider, spinbox)) # type: ignore
+            spinbox_max.editingFinished.connect(self.spinbox_max_changed(spinbox_max, name, slider, spinbox)) # type: ignore
+            spinbox_step.editingFinished.connect(self.spinbox_step_changed(spinbox_step, name, slider, spinbox)) # type: ignore
+            editors = [QLabel('min:'), spinbox_min, QLabel('max:'), spinbox_max, QLabel('step:'), spinbox_step]
+            row = self.param_index[name]
+            for col, widget in enumerate(editors, 5):
+                self.grid.addWidget(widget, row, col, 1, 1)
+            self.param_editors[name] = editors
+        for widget in self.param_editors.get(name, ()):
+            widget.setVisible(on)
+        expand_button.setArrowType(Qt.DownArrow if on else Qt.RightArrow)
+
+    def expand_clicked(self, name):
+        def wrapped(checked):
+            try:
+                self.expand_param(name, checked)
+            except:
+                print_exc()
+        return wrapped
+
+    def build_param_panel(self):
+        self.param_panel_built = True
+        if len(self.param_names) <= self.param_panel_threshold:
+            for name in self.param_names:
+                self.create_param_row(name)
+            self.layout.addLayout(self.grid)
+            return
+        # too many parameters for a grid: a scrollable list where only the rows
+        # scrolled into view are created, with a filter by name
+        self.create_param_row(self.param_names[0])
+        self.row_height = max(w.sizeHint().height() for w in self.param_rows[self.param_names[0]])
+        self.grid.setVerticalSpacing(0)
+        for row in range(len(self.param_names)):
+            self.grid.setRowMinimumHeight(row, self.row_height)
+        inner = QWidget()
+        vbox = QVBoxLayout(inner)
+        vbox.setContentsMargins(0, 0, 0, 0)
+        vbox.addLayout(self.grid)
+        vbox.addStretch()
+        self.param_scroll = QScrollArea()
+        self.param_scroll.setWidgetResizable(True)
+        self.param_scroll.setWidget(inner)
+        self.param_scroll.setMinimumHeight(self.row_height * self.param_panel_rows)
+        scrollbar = self.param_scroll.verticalScrollBar()
+        scrollbar.valueChanged.connect(self.show_visible_params)
+        scrollbar.rangeChanged.connect(self.show_visible_params)
+        self.param_filter = QLineEdit()
+        self.param_filter.setPlaceholderText('filter parameters')
+        self.param_filter.textChanged.connect(self.filter_params)
+        self.layout.addWidget(self.param_filter)
+        self.layout.addWidget(self.param_scroll)
+        self.show_visible_params()
+
+    def filter_params(self, text):
+        try:
+            text = text.strip().lower()
+            self.param_matches = [name for name in self.param_names if text in name.lower()]
+            matches = set(self.param_matches)
+            for name in self.param_names:
+                on = name in matches
+                self.grid.setRowMinimumHeight(self.param_index[name], self.row_height if on else 0)
+                for widget in self.param_rows.get(name, ()):
+                    widget.setVisible(on)
+                expanded = on and getattr(self, name+'_expand').isChecked() if name in self.param_rows else False
+                for widget in self.param_editors.get(name, ()):
+                    widget.setVisible(expanded)
+            self.show_visible_params()
+        except:
+            print_exc()
+
+    def show_visible_params(self, *args):
+        try:
+            top = self.param_scroll.verticalScrollBar().value()
+            height = self.param_scroll.viewport().height()
+            first = top // self.row_height
+            last = (top + height) // self.row_height + 2
+            for name in self.param_matches[first:last]:
+                self.create_param_row(name)
+        except:
+            print_exc()
 
     def __init__(self, *args, **kwargs):
+        setup()
         try:
             super().__init__(parent=None)
 
             self.setGeometry(300, 300, 400, 300)
             self.setWindowTitle('QtInteract')
+            self.scheduler = UpdateScheduler(self.flush_updates, max_rate=self.max_rate, parent=self)
+            self.evaluator = None
+            self.backend = None
+            self.chunker = None
+            self.chunked_funcs = set()
+            self.sweep_names = ()
+            self.players = {}
+            self.sweeps = {}
+            self.sweep_view = None
+            self.sweep_canvas = None
+            self.family_plots = []
+            self.cache = LRUCache(self.cache_bytes) if self.cache_bytes else None
+            self.prefetcher = None
             if len(args) == 1:
                 y = args[0]
                 x, style = None, None
@@ -168,12 +1498,24 @@ class SimpleWindow(QWidget):
                 raise ValueError('Third argument style must either be a str or a list of strs')
 
             self.canvas = pg.PlotWidget()
+            self.perf = PerfMonitor(self.canvas, size=self.perf_size, parent=self)
+            self.draft_styles = None
+            self.paint_times = deque(maxlen=30)
+            self.renderer = {'opengl': False, 'raster_paint': None, 'opengl_paint': None, 'decided': False}
+            self.decimated = {}
+            self.decimate_timer = QTimer(self)
+            self.decimate_timer.setSingleShot(True)
+            self.decimate_timer.timeout.connect(self.redecimate)
+            self.canvas.getViewBox().sigXRangeChanged.connect(self.decimate_timer.start)
+            self.canvas.getViewBox().sigResized.connect(self.decimate_timer.start)
             self.plots = []
             self.static_plots = []
             self.y = []        # for stem plot
             self.static_y = []
             self.funcs = []
             self.funcs_x = []
+            self.static_rows = {}
+            self.streams = []        # (plot, StreamSource)
             default_args = {}
             for i, f in enumerate(y):
                 kw = {}
@@ -198,26 +1540,52 @@ class SimpleWindow(QWidget):
                     })
                 else:
                     raise ValueError(f'Supported styles: ".", "-", ".-", got {style[i]}')
-                if isinstance(f, np.ndarray):
-                    if self.x[i] is None:
-                        self.static_plots.append(self.canvas.plot(np.arange(len(f)), f, **kw))
-                    else:
-                        self.static_plots.append(self.canvas.plot(self.x[i], f, **kw))
+                if isinstance(f, (StreamSource, queue.Queue)) or inspect.isgenerator(f):
+                    if not isinstance(f, StreamSource):
+                        f = StreamSource(f, length=self.stream_length)
+                    self.streams.append((self.canvas.plot([], [], **kw), f))
+                elif isinstance(f, np.ndarray):
+                    p = self.canvas.plot([], [], **kw)
+                    if f.ndim == 2:      # one trace per row, browsed with the row slider
+                        self.static_rows[len(self.static_plots)] = f
+                        f = f[0]
+                    self.set_curve(p, self.x[i], f, static=True)
+                    self.static_plots.append(p)
                     self.static_y.append(f)
                 else:
                     self.plots.append(self.canvas.plot([], [], **kw))
                     self.funcs.append(f)
                     self.funcs_x.append(self.x[i])
                     for k, v in inspect.signature(f).parameters.items():
+                        if k in ('out', 'stride'):
+                            continue
                         default_args[k] = None if v.default is inspect._empty else v.default
                     self.y.append([])
             self.layout.addWidget(self.canvas)
 
             self.param_names = []
-            self.grid_row = 0
+            self.param_index = {}
+            self.state = np.zeros(0)     # current values of the parameters, in param_names order
             self.grid = QGridLayout()
-
-            self.func_kw = [list(inspect.signature(f).parameters) for f in self.funcs]
+            self.param_rows = {}         # name -> widgets of the row, created on demand
+            self.param_editors = {}      # name -> min/max/step editors, created on expand
+            self.param_panel_built = False
+            self.param_scroll = None
+            self.param_filter = None
+            self.param_matches = []
+
+            self.func_kw = [[k for k in inspect.signature(f).parameters if k not in ('out', 'stride')]
+                            for f in self.funcs]
+            self.func_out = ['out' in inspect.signature(f).parameters for f in self.funcs]
+            self.func_stride = ['stride' in inspect.signature(f).parameters for f in self.funcs]
+            self.point_costs = {}        # i -> seconds per evaluated point
+            self.coarse = set()          # functions shown at a reduced resolution
+            self.slider_held = False
+            self.refining = False
+            self.refine_timer = QTimer(self)
+            self.refine_timer.setSingleShot(True)
+            self.refine_timer.timeout.connect(self.refine)
+            self.out_buffers = {}
 
             self.limits = {}
 
@@ -239,8 +1607,34 @@ class SimpleWindow(QWidget):
             for k, v in default_args.items():
                 if v is not None and k not in processed:
                     self.add_param(k, v=v)
-            self.layout.addLayout(self.grid)
+            self.param_matches = list(self.param_names)
+            self.build_param_panel()
+            if self.static_rows:
+                nrows = min(len(f) for f in self.static_rows.values())
+                self.row_slider = QSlider()
+                self.row_slider.setOrientation(Qt.Horizontal)
+                self.row_slider.setRange(0, nrows-1)
+                self.row_slider.valueChanged['int'].connect(self.row_changed) # type: ignore
+                self.row_label = QLabel('row 0')
+                self.layout.addLayout(hStack(QLabel('row:'), self.row_slider, self.row_label))
+            self.param_deps = {name: [i for i, kw in enumerate(self.func_kw) if name in kw]
+                               for name in self.param_names}
+            self.dirty = set()
+            self.funcs_seen = list(self.funcs)
             self.post_create_widgets()
+            self.set_execution(self.execution)
+            self.set_chunked(self.chunked)
+            if self.opengl is True:
+                self.set_opengl(True)
+            elif self.opengl == 'auto':
+                self.perf.add_callback(self.check_renderer)
+            if self.streams:
+                self.stream_versions = {}
+                self.stream_timer = QTimer(self)
+                self.stream_timer.timeout.connect(self.refresh_streams)
+                self.stream_timer.start(round(1000/self.stream_rate))
+                for _, source in self.streams:
+                    source.start()
             self.update()
         except:
             print_exc()
@@ -249,17 +1643,55 @@ class SimpleWindow(QWidget):
         pass
 
     def get_param(self, name):
-        return getattr(self, name+'_spinbox').value()
+        return float(self.state[self.param_index[name]])
 
     def set_param(self, name, value):
+        if name not in self.param_rows:      # the row has not been scrolled into view yet
+            lim = self.limits[name]
+            return self.request_update(name, min(max(value, lim.vmin), lim.vmax))
         return getattr(self, name+'_spinbox').setValue(value)
 
+    def play(self, name, fps=25):
+        self.create_param_row(name)
+        player = self.players.get(name)
+        if player is None:
+            player = self.players[name] = Player(self, name, fps=fps, parent=self)
+        player.fps = fps
+        player.play()
+        getattr(self, name+'_play').setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaPause))
+
+    def pause(self, name):
+        player = self.players.get(name)
+        if player is not None:
+            player.pause()
+        getattr(self, name+'_play').setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaPlay))
+        getattr(self, name+'_fps').setText('')
+
+    def play_clicked(self, name):
+        def wrapped():
+            try:
+                player = self.players.get(name)
+                if player is not None and player.playing:
+                    self.pause(name)
+                else:
+                    self.play(name, fps=player.fps if player is not None else 25)
+            except:
+                print_exc()
+        return wrapped
+
+    def frame_shown(self):
+        for name, player in self.players.items():
+            if player.playing:
+                player.frame_shown()
+                if player.nframes % 10 == 0:
+                    getattr(self, name+'_fps').setText(f'{player.achieved_fps:.0f}/{player.fps} fps')
+
     def slider_changed(self, name, spin):
         def wrapped(k):
             try:
                 v = self.limits[name].k2v(k)
                 set_value_nc(spin, v)
-                self.update(name, v)
+                self.request_update(name, v)
             except:
                 print_exc()
         return wrapped
@@ -269,7 +1701,7 @@ class SimpleWindow(QWidget):
             try:
                 k = self.limits[name].v2k(v)
                 set_value_nc(slider, k)
-                self.update(name, v)
+                self.request_update(name, v)
             except:
                 print_exc()
         return wrapped
@@ -285,6 +1717,7 @@ class SimpleWindow(QWidget):
                 k = self.limits[name].v2k(v)
                 slider.setMaximum(lim.nsteps)
                 set_value_nc(slider, k)
+                self.invalidate_param(name)
             except:
                 print_exc()
         return wrapped
@@ -300,6 +1733,7 @@ class SimpleWindow(QWidget):
                 k = self.limits[name].v2k(v)
                 slider.setMaximum(lim.nsteps)
                 set_value_nc(slider, k)
+                self.invalidate_param(name)
             except:
                 print_exc()
         return wrapped
@@ -327,54 +1761,680 @@ class SimpleWindow(QWidget):
                 k = self.limits[name].v2k(v)
                 slider.setMaximum(lim.nsteps)
                 set_value_nc(slider, k)
+                self.invalidate_param(name)
             except:
                 print_exc()
         return wrapped
 
+    def request_update(self, name, value):
+        self.state[self.param_index[name]] = value
+        self.perf.event_received()
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
+        self.scheduler.request(name, value)
+        if self.progressive and self.slider_held:
+            self.refine_timer.start(self.refine_delay)
+
+    def slider_pressed(self):
+        self.slider_held = True
+        self.begin_interaction()
+
+    def slider_released(self):
+        self.slider_held = False
+        self.end_interaction()
+        self.refine()
+
+    def begin_interaction(self):
+        if self.draft_quality and self.draft_styles is None:
+            self.draft_styles = set_draft_style(self.get_curves())
+
+    def end_interaction(self):
+        if self.draft_styles is not None:
+            restore_style(self.draft_styles)
+            self.draft_styles = None
+
+    def set_opengl(self, on=True):
+        if on and not opengl_available():
+            print('OpenGL is not available, keeping the raster renderer')
+            self.renderer['decided'] = True
+            on = False
+        self.canvas.useOpenGL(on)
+        self.renderer['opengl'] = on
+
+    def check_renderer(self, rec):
+        # opengl='auto': after 30 slow frames try OpenGL, keep it if the next 30 are faster
+        if self.renderer['decided'] or np.isnan(rec['t_paint']):
+            return
+        self.paint_times.append(rec['t_paint'] - rec['t_setdata'])
+        if len(self.paint_times) < self.paint_times.maxlen:
+            return
+        t = float(np.median(self.paint_times))
+        self.paint_times.clear()
+        if not self.renderer['opengl']:
+            self.renderer['raster_paint'] = t
+            if t > self.opengl_threshold:
+                self.set_opengl(True)
+            self.renderer['decided'] = not self.renderer['opengl']
+        else:
+            self.renderer['opengl_paint'] = t
+            if t >= self.renderer['raster_paint']:
+                self.set_opengl(False)
+            self.renderer['decided'] = True
+
+    def refine(self):
+        # replace the coarse curves by full resolution ones
+        try:
+            self.refine_timer.stop()
+            self.scheduler.flush()
+            if not self.coarse:
+                return
+            self.refining = True
+            self.dirty.update(self.coarse)
+            self.update(changed=[])
+        except:
+            print_exc()
+        finally:
+            self.refining = False
+
+    def coarse_strides(self, current, funcs):
+        if not self.progressive or not self.slider_held or self.refining:
+            return {}
+        budget = self.latency_target / max(len(funcs), 1)
+        strides = {}
+        for i in funcs:
+            if i not in self.point_costs or self.sweep_names:
+                continue
+            if self.funcs_x[i] is not None:
+                n = len(self.funcs_x[i])
+            elif self.func_stride[i]:
+                n = len(self.y[i])
+            else:
+                continue     # an x-less function can only be evaluated coarsely if it takes stride
+            if self.cache is not None:
+                key = self.cache_key(i, current)
+                if key is not None and key in self.cache:
+                    continue
+            stride = ceil(self.point_costs[i] * n / budget)
+            if stride > 1:
+                strides[i] = stride
+        return strides
+
+    def flush_updates(self, pending):
+        if self.prefetcher is not None:
+            name = list(pending)[-1]
+            self.prefetcher.moved(name, self.limits[name].v2k(pending[name]))
+        self.update(changed=pending)
+
     def get_all_plots(self):
         yield from self.static_plots
         yield from self.plots
 
-    def update(self, name=None, value=None):
+    def get_curves(self):
+        # everything drawn on the main canvas, including streams
+        yield from self.get_all_plots()
+        for p, _ in self.streams:
+            yield p
+
+    def set_execution(self, mode, max_workers=None):
+        if mode not in ('sync', 'thread', 'process'):
+            raise ValueError(f'Supported execution modes: "sync", "thread", "process", got {mode}')
+        if self.evaluator is not None:
+            self.evaluator.shutdown()
+            self.evaluator = None
+        if self.backend is not None:
+            self.backend.shutdown()
+            self.backend = None
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
+        self.out_buffers = {}
+        if mode in ('thread', 'process'):
+            self.evaluator = AsyncEvaluator(self.evaluate, self.apply_results, parent=self)
+        if mode == 'process':
+            self.backend = ProcessBackend(self.funcs, self.funcs_x, max_workers=max_workers)
+        # in 'sync' mode the functions never run off the GUI thread
+        if mode != 'sync' and self.prefetch and self.cache is not None:
+            self.prefetcher = Prefetcher(self, parent=self)
+        self.execution = mode
+
+    def set_chunked(self, on=True, funcs=None, max_workers=None):
+        '''
+        Evaluate the functions with the given indices (all by default) over slices
+        of x in parallel. Only valid for elementwise functions: f(x)[i:j] == f(x[i:j]).
+        '''
+        if self.chunker is not None:
+            self.chunker.shutdown()
+            self.chunker = None
+        self.chunked_funcs = set()
+        if on:
+            self.chunker = ChunkedEvaluator(max_workers=max_workers)
+            self.chunked_funcs = set(range(len(self.funcs)) if funcs is None else funcs)
+        self.chunked = on
+
+    def is_chunked(self, i):
+        x = self.funcs_x[i]
+        return i in self.chunked_funcs and x is not None and np.ndim(x) == 1 and \
+               len(x) >= 2*self.chunker.min_chunk
+
+    def current_params(self):
+        return dict(zip(self.param_names, self.state.tolist()))
+
+    def dependent_funcs(self, names):
+        funcs = set()
+        for name in names:
+            funcs.update(self.param_deps.get(name, ()))
+        return funcs
+
+    def param_key(self, name, v):
+        lim = self.limits[name]
+        k = lim.v2k(v)
+        if abs(lim.k2v(k) - v) > abs(lim.vstep)*1e-6:
+            return None
+        return k
+
+    def cache_key(self, i, current):
+        ks = []
+        for name in self.func_kw[i]:
+            if name == 'x' and self.funcs_x[i] is not None:
+                continue
+            if name not in self.limits:
+                return None
+            k = self.param_key(name, current[name])
+            if k is None:
+                return None
+            ks.append((name, k))
+        return (i, self.funcs[i], tuple(ks))
+
+    def invalidate_param(self, name):
+        if self.cache is not None:
+            self.cache.invalidate(lambda key: any(n == name for n, k in key[2]))
+
+    def sweep(self, *names, view=None):
+        if len(names) > 2:
+            raise ValueError(f'Up to two parameters can be swept, got {len(names)}')
+        for name in names:
+            if name not in self.limits:
+                raise ValueError(f'Unknown parameter {name}')
+        self.sweep_names = names
+        self.sweeps = {}
+        self.update()
+        if view is not None:
+            self.show_sweep(view)
+        return self
+
+    def sweep_value(self, i, current):
+        names = [name for name in self.sweep_names if name in self.func_kw[i]]
+        if not names or self.funcs_x[i] is None or self.sweeps.get(i) is False:
+            return None
+        ks = [self.param_key(name, current[name]) for name in names]
+        if None in ks:
+            return None
+        fixed = {k: current[k] for k in self.func_kw[i] if k != 'x' and k not in names}
+        limits = [self.limits[name] for name in names]
+        table = self.sweeps.get(i)
+        if table is None or not table.matches(self.funcs[i], fixed, limits):
+            try:
+                table = SweepTable(self.funcs[i], self.funcs_x[i], names, limits, fixed,
+                                   max_bytes=self.sweep_bytes)
+            except:
+                print_exc()
+                print(f'f{i} cannot be swept, falling back to direct evaluation')
+                self.sweeps[i] = False
+                return None
+            self.sweeps[i] = table
+        return table[ks]
+
+    def show_sweep(self, kind='heatmap', i=0):
+        if kind not in ('heatmap', 'family', None):
+            raise ValueError(f'Supported sweep views: "heatmap", "family", got {kind}')
+        if kind == 'heatmap' and self.sweep_canvas is None:
+            self.sweep_canvas = pg.PlotWidget()
+            self.sweep_image = pg.ImageItem()
+            self.sweep_image.setColorMap(pg.colormap.get('viridis'))
+            self.sweep_canvas.addItem(self.sweep_image)
+            self.sweep_hline = pg.InfiniteLine(0, angle=0, pen='pink')
+            self.sweep_canvas.addItem(self.sweep_hline)
+            self.sweep_canvas.enableAutoRange(x=False)
+            self.sweep_canvas.setXLink(self.canvas)
+            self.layout.insertWidget(1, self.sweep_canvas)
+        if self.sweep_canvas is not None:
+            self.sweep_canvas.setVisible(kind == 'heatmap')
+        for p in self.family_plots:
+            self.canvas.removeItem(p)
+        self.family_plots = []
+        self.sweep_view = (kind, i) if kind is not None else None
+        self.refresh_sweep_view()
+
+    def refresh_sweep_view(self):
+        if self.sweep_view is None:
+            return
+        kind, i = self.sweep_view
+        table = self.sweeps.get(i)
+        if not table:
+            return
+        block = table.table
+        if block.ndim == 3:
+            block = block[:, self.limits[table.names[1]].v2k(self.get_param(table.names[1])), :]
+        x = self.funcs_x[i]
+        if kind == 'heatmap':
+            lim = table.limits[0]
+            self.sweep_image.setImage(block)
+            self.sweep_image.setRect(QRectF(x[0], lim.vmin, x[-1]-x[0], lim.vmax-lim.vmin))
+            self.sweep_hline.setPos(self.get_param(table.names[0]))
+            self.sweep_canvas.getPlotItem().setLabel('left', table.names[0])
+        elif kind == 'family':
+            rows = np.unique(np.linspace(0, len(block)-1, 16).round().astype(int))
+            if len(self.family_plots) != len(rows):
+                for p in self.family_plots:
+                    self.canvas.removeItem(p)
+                pen = pg.mkPen((100, 100, 255, 60))
+                self.family_plots = [self.canvas.plot([], [], pen=pen) for _ in rows]
+                for p in self.family_plots:
+                    p.setZValue(-1)
+            for p, row in zip(self.family_plots, rows):
+                p.setData(x, block[row])
+
+    def eval_func(self, i, current):
+        if self.sweep_names:
+            y = self.sweep_value(i, current)
+            if y is not None:
+                return y
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(i, current)
+            if key is not None:
+                y = self.cache.get(key)
+                if y is not None:
+                    return y
+        # in process mode every result comes back through an out buffer in shared memory
+        out = self.out_buffer(i) if self.func_out[i] or self.backend is not None or self.is_chunked(i) else None
+        t0 = perf_counter()
+        y = self.compute(i, current, out=out)
+        self.record_cost(i, perf_counter() - t0, len(y))
+        if key is not None:
+            self.cache.put(key, y.copy() if y is out else y)
+        return y
+
+    def eval_coarse(self, i, current, stride):
+        t0 = perf_counter()
+        y = np.asarray(self.compute(i, current, stride=stride))
+        if self.funcs_x[i] is not None:
+            x = self.funcs_x[i][::stride]
+        else:
+            x = np.arange(len(y)) * stride
+        self.record_cost(i, perf_counter() - t0, len(y))
+        return Coarse(x, y, stride)
+
+    def record_cost(self, i, seconds, n):
+        cost = seconds / max(n, 1)
+        old = self.point_costs.get(i)
+        self.point_costs[i] = cost if old is None else (old + cost) / 2
+
+    def out_shape(self, i):
+        if self.funcs_x[i] is not None:
+            return np.shape(self.funcs_x[i]), np.float64
+        elif isinstance(self.y[i], np.ndarray):
+            return self.y[i].shape, self.y[i].dtype
+        return None, None      # x-less function: the shape is known after the first call
+
+    def out_buffer(self, i):
+        # two buffers per curve used in turns, so that the one on screen is never overwritten
+        if i not in self.out_buffers:
+            shape, dtype = self.out_shape(i)
+            if shape is None:
+                return None
+            if self.backend is not None:
+                self.out_buffers[i] = [self.backend.allocate(shape, dtype) for _ in range(2)]
+            else:
+                self.out_buffers[i] = [np.empty(shape, dtype), np.empty(shape, dtype)]
+        bufs = self.out_buffers[i]
+        return bufs[1] if bufs[0] is self.y[i] else bufs[0]
+
+    def fill_cache(self, i, params):
+        key = self.cache_key(i, params)
+        if key is None or key in self.cache:
+            return False
+        self.cache.put(key, self.compute(i, params))
+        return True
+
+    def func_args(self, i, current):
+        if self.funcs_x[i] is None:
+            return {k: current[k] for k in self.func_kw[i]}
+        else:
+            return {k: current[k] for k in self.func_kw[i] if k != 'x'}
+
+    def compute(self, i, current, out=None, stride=None):
+        # stride: every stride-th point of x (or passed on to x-less functions), for coarse previews
+        f = self.funcs[i]
+        kw = self.func_args(i, current)
+        x = self.funcs_x[i]
+        if stride is not None:
+            if x is None:
+                kw['stride'] = stride
+            else:
+                x = x[::stride]
+        if self.backend is not None:
+            y = self.backend.compute(i, kw, out=out, stride=stride if x is not None else None)
+        elif self.is_chunked(i) and len(x) >= 2*self.chunker.min_chunk:
+            key = i if stride is None else ('coarse', i)
+            y = self.chunker.compute(key, f, x, kw, out=out, func_out=self.func_out[i])
+        else:
+            if out is None and self.func_out[i]:      # cache filling: a fresh array every time
+                shape, dtype = self.out_shape(i) if stride is None else (np.shape(x) if x is not None else None, np.float64)
+                out = np.empty(shape, dtype) if shape is not None else None
+            if out is not None:
+                kw['out'] = out
+            if x is None:
+                y = f(**kw)
+            else:
+                y = f(x, **kw)
+            if y is None:       # written into out
+                y = out
+        if y is None:
+            raise ValueError(f'{getattr(f, "__name__", f)} returned None: functions should return the result '
+                             'or, if they take out=, write it into out')
+        return y
+
+    def lookup_cached(self, current, funcs):
+        if self.cache is None:
+            return None
+        results = []
+        for i in funcs:
+            key = self.cache_key(i, current)
+            if key is None or key not in self.cache:
+                return None
+            results.append((i, self.cache.get(key)))
+        return results
+
+    def evaluate(self, current, funcs, rec=None, strides=None):
+        strides = strides or {}
+        def eval_one(i):
+            if i in strides:
+                return self.eval_coarse(i, current, strides[i])
+            return self.eval_func(i, current)
+        if rec is None:
+            return [(i, eval_one(i)) for i in funcs]
+        results = []
+        rec['t_eval_start'] = perf_counter()
+        for i in funcs:
+            t0 = perf_counter()
+            results.append((i, eval_one(i)))
+            rec['funcs'].append((i, t0, perf_counter()))
+        rec['t_eval_end'] = perf_counter()
+        return results
+
+    def apply_results(self, results):
         try:
-            current = {}
-            for k in self.param_names:
-                if k != name:
-                    current[k] = getattr(self, k+'_spinbox').value()
-                else:
-                    current[k] = value
-            for i, p in enumerate(self.plots):
-                if self.funcs_x[i] is None:
-                    kw = {k: current[k] for k in self.func_kw[i]}
-                    self.y[i] = self.funcs[i](**kw)
-                    p.setData({'y': self.y[i]})
+            for i, y in results:
+                self.dirty.discard(i)
+                if isinstance(y, Coarse):      # self.y keeps the last full resolution result
+                    self.coarse.add(i)
+                    self.set_curve(self.plots[i], y.x, y.y)
+                    continue
+                self.coarse.discard(i)
+                self.y[i] = y
+                self.set_curve(self.plots[i], self.funcs_x[i], y)
+            self.refresh_sweep_view()
+            self.post_update()
+            self.perf.set_data_done()
+            self.frame_shown()
+            if self.prefetcher is not None:
+                self.prefetcher.schedule()
+        except:
+            print_exc()
+
+    def post_update(self):
+        pass
+
+    def refresh_streams(self):
+        try:
+            for p, source in self.streams:
+                version = source.buffer.version
+                if self.stream_versions.get(p) == version:
+                    continue
+                self.stream_versions[p] = version
+                x, y = source.buffer.read()
+                self.set_curve(p, x, y)
+        except:
+            print_exc()
+
+    def show_hud(self, on=True):
+        self.perf.show_hud(on)
+
+    def export(self, settings, directory='.', prefix='frame', size=None, max_workers=None):
+        '''
+        Renders one frame per parameter setting without showing the window:
+        <prefix>_00000.png with the plots, <prefix>_00000.npz with the curves and
+        <prefix>.csv with the parameters of every frame. settings is either a list
+        of dicts (missing parameters keep their current values) or a dict of
+        sequences, expanded into a grid. The functions are evaluated in worker
+        processes a few frames ahead, the frames are drawn in this thread.
+        Returns the paths of the frames without extensions.
+        '''
+        if isinstance(settings, dict):
+            settings = param_grid(**settings)
+        current = self.current_params()
+        frames = []
+        for s in settings:
+            unknown = set(s) - set(current)
+            if unknown:
+                raise ValueError(f'Unknown parameters: {", ".join(sorted(unknown))}')
+            frames.append(dict(current, **s))
+        os.makedirs(directory, exist_ok=True)
+        if size is not None:
+            self.resize(*size)
+            self.layout.activate()
+        backend = self.backend
+        if backend is None:
+            backend = ProcessBackend(self.funcs, self.funcs_x, max_workers=max_workers)
+        else:
+            backend.register(self.funcs)
+        lookahead = 2 * (max_workers or os.cpu_count() or 1)
+        saved = [(i, y) for i, y in enumerate(self.y) if isinstance(y, np.ndarray)]
+        futures = deque()
+        paths = []
+        try:
+            with open(os.path.join(directory, prefix + '.csv'), 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame'] + self.param_names)
+                for n, params in enumerate(frames):
+                    while len(futures) < lookahead and n + len(futures) < len(frames):
+                        p = frames[n + len(futures)]
+                        futures.append(backend.submit_frame(
+                            [(i, self.func_args(i, p)) for i in range(len(self.funcs))]))
+                    results = list(enumerate(futures.popleft().result()))
+                    path = os.path.join(directory, f'{prefix}_{n:05d}')
+                    self.draw_frame(results)
+                    self.render_frame(path + '.png')
+                    arrays = {f'y{i}': y for i, y in results}
+                    arrays.update({f'x{i}': x for i, x in enumerate(self.funcs_x) if x is not None})
+                    np.savez(path + '.npz', names=np.array(self.param_names),
+                             values=np.array([params[name] for name in self.param_names]), **arrays)
+                    writer.writerow([n] + [params[name] for name in self.param_names])
+                    paths.append(path)
+        finally:
+            for future in futures:
+                future.cancel()
+            if backend is not self.backend:
+                backend.shutdown()
+            self.draw_frame(saved)
+        return paths
+
+    def draw_frame(self, results):
+        for i, y in results:
+            self.coarse.discard(i)
+            self.y[i] = y
+            self.set_curve(self.plots[i], self.funcs_x[i], y)
+        self.post_update()
+
+    def export_widgets(self):
+        return [self.canvas]
+
+    def render_frame(self, path):
+        pixmaps = [w.grab() for w in self.export_widgets()]
+        if len(pixmaps) == 1:
+            pixmaps[0].save(path)
+            return
+        image = QImage(max(p.width() for p in pixmaps), sum(p.height() for p in pixmaps),
+                       QImage.Format_RGB32)
+        image.fill(Qt.white)
+        painter = QPainter(image)
+        y = 0
+        for p in pixmaps:
+            painter.drawPixmap(0, y, p)
+            y += p.height()
+        painter.end()
+        image.save(path)
+
+    def row_changed(self, k):
+        try:
+            for j, rows in self.static_rows.items():
+                self.static_y[j] = rows[k]
+                self.set_curve(self.static_plots[j], self.x[j], rows[k], static=True)
+            self.row_label.setText(f'row {k}')
+            self.post_update()
+        except:
+            print_exc()
+
+    def set_curve(self, p, x, y, static=False):
+        if self.decimate_threshold is None or len(y) <= self.decimate_threshold:
+            self.decimated.pop(p, None)
+            if x is None:
+                p.setData({'y': y})
+            else:
+                p.setData({'x': x, 'y': y})
+            return
+        y = np.asarray(y)
+        if x is None:
+            x = np.arange(len(y))
+        pyramid = None
+        if static:
+            pyramid = MinMaxPyramid(y)
+        self.decimated[p] = (x, y, pyramid)
+        idx = self.decimation_indices(x, y, pyramid)
+        p.setData({'x': x[idx], 'y': y[idx]})
+
+    def decimation_indices(self, x, y, pyramid=None):
+        vb = self.canvas.getViewBox()
+        nbuckets = max(round(vb.width()), 100) if vb.width() > 0 else 1000
+        i0, i1 = 0, len(y)
+        if not vb.autoRangeEnabled()[0] and x[0] <= x[-1]:
+            # only the visible slice plus a bucket on each side for the lines going off screen
+            (xmin, xmax), _ = vb.viewRange()
+            i0, i1 = np.searchsorted(x, [xmin, xmax])
+            margin = (i1-i0) // nbuckets + 1
+            i0, i1 = max(i0-margin, 0), min(i1+margin, len(y))
+            if i1 <= i0:
+                return np.arange(0)
+        idx = None
+        if pyramid is not None:
+            idx = pyramid.query(i0, i1, nbuckets)
+        if idx is None:
+            idx = minmax_indices(y, i0, i1, nbuckets)
+        return idx
+
+    def redecimate(self):
+        try:
+            for p, (x, y, pyramid) in self.decimated.items():
+                idx = self.decimation_indices(x, y, pyramid)
+                p.setData({'x': x[idx], 'y': y[idx]})
+        except:
+            print_exc()
+
+    def update(self, name=None, value=None, changed=None):
+        try:
+            if name is not None:
+                self.state[self.param_index[name]] = value
+                changed = [name]
+            if changed is None:
+                self.dirty.update(range(len(self.funcs)))
+            else:
+                self.dirty.update(self.dependent_funcs(changed))
+            for i, f in enumerate(self.funcs):
+                if f is not self.funcs_seen[i]:      # function replaced at runtime
+                    self.funcs_seen[i] = f
+                    self.func_out[i] = 'out' in inspect.signature(f).parameters
+                    self.func_stride[i] = 'stride' in inspect.signature(f).parameters
+                    self.point_costs.pop(i, None)
+                    self.dirty.add(i)
+                    if self.chunker is not None:
+                        self.chunker.forget(i)
+                        self.chunker.forget(('coarse', i))
+            if self.backend is not None:
+                self.backend.register(self.funcs)
+            if not self.dirty:
+                self.frame_shown()
+                return
+            funcs = sorted(self.dirty)
+            current = self.current_params()
+            rec = self.perf.begin()
+            strides = self.coarse_strides(current, funcs)
+            if self.evaluator is None:
+                self.apply_results(self.evaluate(current, funcs, rec, strides))
+            elif strides:
+                self.evaluator.submit(current, funcs, rec, strides)
+            else:
+                cached = self.lookup_cached(current, funcs)
+                if cached is not None:
+                    self.evaluator.supersede()
+                    rec['t_eval_start'] = rec['t_eval_end'] = perf_counter()
+                    self.apply_results(cached)
                 else:
-                    kw = {k: current[k] for k in self.func_kw[i] if k != 'x'}
-                    self.y[i] = self.funcs[i](self.funcs_x[i], **kw)
-                    p.setData({'x': self.funcs_x[i], 'y': self.y[i]})
+                    self.evaluator.submit(current, funcs, rec)
         except:
             print_exc()
 
+    def closeEvent(self, event):
+        if self.evaluator is not None:
+            self.evaluator.shutdown()
+        if self.backend is not None:
+            self.backend.shutdown()
+        if self.chunker is not None:
+            self.chunker.shutdown()
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+        for player in self.players.values():
+            player.shutdown()
+        if self.streams:
+            self.stream_timer.stop()
+        for _, source in self.streams:
+            source.stop()
+        self.perf.close()
+        super().closeEvent(event)
+
 class FitTool(SimpleWindow):
     def post_create_widgets(self):
+        import scipy.optimize     # load it now rather than on the first drag
         self.fit_button = QPushButton('Fit')
         self.fit_button.clicked.connect(self.fit_button_clicked)
         hbox = QHBoxLayout()
         hbox.addWidget(self.fit_button)
+        self.batch_fitter = None
+        self.batch_results = None
+        self.batch_row_shown = False
+        if self.static_rows:
+            self.fit_all_button = QPushButton('Fit all rows')
+            self.fit_all_button.clicked.connect(self.fit_all_clicked)
+            self.batch_label = QLabel()
+            hbox.addWidget(self.fit_all_button)
+            hbox.addWidget(self.batch_label)
         hbox.addStretch()
         hbox.insertStretch(0)
         self.layout.addLayout(hbox)
 
         self.line1 = pg.InfiniteLine(0, movable=True, angle=90, pen='pink')
         self.line1.sigDragged.connect(self.line1_dragged)
+        self.line1.sigPositionChangeFinished.connect(self.line_released)
         self.canvas.addItem(self.line1)
 
         self.line2 = pg.InfiniteLine(1, movable=True, angle=90, pen='pink')
         self.line2.sigDragged.connect(self.line2_dragged)
+        self.line2.sigPositionChangeFinished.connect(self.line_released)
         self.canvas.addItem(self.line2)
 
         self.line1pos = None
         self.line2pos = None
+        self.residual = None
 
         self.canvas2 = pg.PlotWidget()
         self.stem1 = self.canvas2.plot([], [], symbolPen='b', symbolBrush=None, pen=None)
@@ -385,22 +2445,87 @@ class FitTool(SimpleWindow):
         self.layout.addWidget(self.canvas2)
         self.canvas2.setXLink(self.canvas)
 
+        self.fitter = AsyncFitter(self.fit_done, self.set_params, parent=self)
+        self.fitter.done.connect(self.fit_finished)      # after fit_done
+        self.stem_styles = None
+        self.last_fit = None      # last converged parameters, the initial guess for the next fit
 
     def fit_button_clicked(self):
+        self.start_fit(warm=False)
+
+    def start_fit(self, warm=True):
         try:
-            p0 = [self.get_param(name) for name in self.param_names]
+            if warm and self.last_fit is not None:
+                p0 = self.last_fit
+            else:
+                p0 = [self.get_param(name) for name in self.param_names]
             x1 = self.line1.value()
             i1 = np.searchsorted(self.x[0], x1)
             x2 = self.line2.value()
             i2 = np.searchsorted(self.x[0], x2)
-            p, _ = curve_fit(self.funcs[0], self.x[0][i1:i2+1], self.static_y[0][i1:i2+1], p0=p0)
-            for name, value in zip(self.param_names, p):
-                self.set_param(name, value)
+            self.fitter.submit(self.funcs[0], list(self.param_names),
+                               self.x[0][i1:i2+1], self.static_y[0][i1:i2+1], p0)
         except:
             print_exc()
 
-    def update(self, *args, **kwargs):
-        super().update(*args, **kwargs)
+    def fit_all_clicked(self):
+        self.batch_fit()
+
+    def batch_fit(self, max_workers=None):
+        try:
+            if self.batch_fitter is not None:
+                self.batch_fitter.cancel()
+            p0 = [self.get_param(name) for name in self.param_names]
+            i1 = np.searchsorted(self.x[0], self.line1.value())
+            i2 = np.searchsorted(self.x[0], self.line2.value())
+            self.batch_fitter = BatchFitter(self.funcs[0], self.param_names, self.x[0][i1:i2+1],
+                                            self.static_rows[0][:, i1:i2+1], p0,
+                                            max_workers=max_workers, parent=self)
+            self.batch_results = self.batch_fitter.results
+            self.batch_fitter.progress.connect(self.batch_progress)
+            self.batch_fitter.start()
+        except:
+            print_exc()
+
+    def batch_progress(self, ndone, ntotal):
+        nfailed = np.count_nonzero(~self.batch_results['success'] & (self.batch_results['message'] != ''))
+        self.batch_label.setText(f'fitted {ndone}/{ntotal}, failed {nfailed}')
+        if not self.batch_row_shown:
+            self.row_changed(self.row_slider.value())
+
+    def row_changed(self, k):
+        super().row_changed(k)
+        if self.batch_results is not None:
+            r = self.batch_results[k]
+            self.batch_row_shown = bool(r['success'] or r['message'])
+            if r['success']:
+                self.set_params([r[name] for name in self.param_names])
+                self.row_label.setText(f'row {k}: converged, chi2={r["chi2"]:.4g}')
+            elif r['message']:
+                self.row_label.setText(f'row {k}: {r["message"]}')
+            else:
+                self.row_label.setText(f'row {k}: pending')
+
+    def fit_done(self, p):
+        self.last_fit = [float(v) for v in p]
+        self.set_params(p)
+
+    def fit_finished(self, generation, result):
+        # a converged or failed fit that changed nothing leaves the line drag without an update
+        if self.fitter.running is None and self.fitter.pending is None and not self.scheduler.pending:
+            self.perf.discard_event()
+
+    def set_params(self, p):
+        for name, value in zip(self.param_names, p):
+            self.set_param(name, value)
+
+    def closeEvent(self, event):
+        self.fitter.shutdown()
+        if self.batch_fitter is not None:
+            self.batch_fitter.cancel()
+        super().closeEvent(event)
+
+    def post_update(self):
         if self.line1pos is None:
             self.line1pos = min(p.dataBounds(0)[0] for p in self.get_all_plots())
             self.line2pos = max(p.dataBounds(0)[1] for p in self.get_all_plots())
@@ -408,21 +2533,534 @@ class FitTool(SimpleWindow):
             print(self.line1pos, self.line2pos)
             self.line1.setValue(self.line1pos)
             self.line2.setValue(self.line2pos)
-        x, y = self.x[0], self.y[0]-self.static_y[0]
+        self.update_stems()
+
+    def export_widgets(self):
+        return [self.canvas, self.canvas2]
+
+    def update_stems(self):
+        x = self.x[0]
+        n = len(self.static_y[0])
+        if self.residual is None or len(self.residual) != n:
+            self.residual = np.empty(n)
+            self.stem_x = np.repeat(x, 2)
+            self.stem_y = np.zeros(2*n)
+        y = np.subtract(self.y[0], self.static_y[0], out=self.residual)
+        if self.decimate_threshold is not None and n > self.decimate_threshold:
+            idx = self.decimation_indices(x, y)
+            x, y = x[idx], y[idx]
+            self.stem1.setData(x=x, y=y)
+            self.stem2.setData(x=np.repeat(x, 2), y=np.dstack((np.zeros(y.shape[0]), y)).flatten())
+            return
+        # the stem geometry is updated in place: only the odd y's (the stem tips) change
+        self.stem_y[1::2] = y
         self.stem1.setData(x=x, y=y)
-        self.stem2.setData(x=np.repeat(x, 2), y=np.dstack((np.zeros(y.shape[0]), y)).flatten())
+        self.stem2.setData(x=self.stem_x, y=self.stem_y)
+
+    def redecimate(self):
+        super().redecimate()
+        if self.decimate_threshold is not None and len(self.x[0]) > self.decimate_threshold:
+            self.update_stems()
+
+    def begin_line_drag(self):
+        self.begin_interaction()
+        if self.draft_quality and self.stem_styles is None:
+            self.stem_styles = set_draft_style([self.stem1, self.stem2], symbols_to_pen=False)
+
+    def line_released(self, line):
+        self.end_interaction()
+        restore_style(self.stem_styles or {})
+        self.stem_styles = None
 
     def line1_dragged(self, line):
-        self.fit_button_clicked()
+        self.begin_line_drag()
+        self.perf.event_received()
+        self.start_fit()
 #        print(line.value())
 
     def line2_dragged(self, line):
-        self.fit_button_clicked()
+        self.begin_line_drag()
+        self.perf.event_received()
+        self.start_fit()
 #        print(line.value())
 
 
+_session_tile_dir = None
+
+def session_tile_dir():
+    # pyramids of in-memory arrays, removed when the interpreter exits
+    global _session_tile_dir
+    if _session_tile_dir is None:
+        _session_tile_dir = tempfile.mkdtemp(prefix='qtinteract-tiles-')
+        atexit.register(shutil.rmtree, _session_tile_dir, ignore_errors=True)
+    return _session_tile_dir
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class TiledImage:
+    '''
+    Image pyramid of a large 2D array (np.memmap or anything that supports 2D
+    slicing, .shape and .dtype). Level j is the array averaged over 2**j x 2**j
+    blocks; levels 1, 2, ... are built once, strip by strip, and stored as .npy
+    files. Only the tiles covering the requested region are read.
+
+    Pyramids of memmaps are kept in cache_dir between sessions, keyed by the
+    file name, size and mtime; the least recently used ones are deleted when
+    the directory grows over disk_bytes. Other arrays cannot be recognized
+    cheaply, so their pyramids go to a per-session directory and are deleted
+    with the TiledImage.
+    '''
+    def __init__(self, arr, cache_dir=None, tile=512, cache_bytes=256*2**20, disk_bytes=4*2**30):
+        self.arr = arr
+        self.shape = tuple(arr.shape[:2])
+        self.tile = tile
+        filename = getattr(arr, 'filename', None)
+        self.persistent = filename is not None and os.path.exists(filename)
+        if self.persistent:
+            self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'qtinteract-tiles')
+        else:
+            self.cache_dir = session_tile_dir()
+        self.disk_bytes = disk_bytes
+        self.tiles = LRUCache(cache_bytes)
+        self.levels = [arr]
+        self.paths = [None]
+        self.sat = None
+        self.build()
+        self.files = list(self.paths[1:])       # everything written for this array
+        if not self.persistent:
+            weakref.finalize(self, _remove_files, self.files)
+
+    def cache_key(self):
+        if not self.persistent:
+            return uuid.uuid4().hex
+        h = hashlib.sha1(repr((self.shape, str(self.arr.dtype), self.tile)).encode())
+        filename = self.arr.filename
+        st = os.stat(filename)
+        h.update(repr((os.path.abspath(filename), st.st_size, st.st_mtime, self.file_layout())).encode())
+        return h.hexdigest()
+
+    def file_layout(self):
+        # a slice or a transpose of a memmap keeps the filename and offset of the whole
+        # file, so tell the views apart by the position of their first element and strides
+        arr, root = self.arr, self.arr
+        while isinstance(root.base, np.memmap):
+            root = root.base
+        start = arr.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+        return getattr(root, 'offset', 0) + start, arr.strides
+
+    def build(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.key = key = self.cache_key()
+        src = self.arr
+        j = 0
+        while max(src.shape) > self.tile:
+            j += 1
+            path = os.path.join(self.cache_dir, f'{key}-{j}.npy')
+            if os.path.exists(path):
+                os.utime(path)        # recently used, see prune()
+            else:
+                self.downsample(src, path)
+            src = np.load(path, mmap_mode='r')
+            self.levels.append(src)
+            self.paths.append(path)
+        if self.persistent:
+            self.prune(key)
+
+    def prune(self, key):
+        # deletes the least recently used pyramids until cache_dir fits in disk_bytes
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((name.startswith(key), st.st_mtime, st.st_size, path))
+        total = sum(size for _, _, size, _ in files)
+        for current, _, size, path in sorted(files):
+            if total <= self.disk_bytes or current:
+                break
+            _remove_files([path])
+            total -= size
+
+    def downsample(self, src, path, strip=256):
+        h, w = src.shape[0] // 2, src.shape[1] // 2
+        tmp = path + '.tmp'
+        dst = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(h, w))
+        self.fill(src, dst, 0, h, 0, w, strip)
+        dst.flush()
+        del dst
+        os.replace(tmp, path)
+
+    def fill(self, src, dst, r0, r1, c0, c1, strip=256):
+        # dst[r0:r1, c0:c1] = src averaged over 2x2 blocks
+        for r in range(r0, r1, strip):
+            re = min(r+strip, r1)
+            block = np.asarray(src[2*r:2*re, 2*c0:2*c1], dtype=np.float32)
+            dst[r:re, c0:c1] = block.reshape(re-r, 2, c1-c0, 2).mean(axis=(1, 3))
+
+    def summed_area_table(self):
+        '''
+        SummedAreaTable of the full resolution array, built on first use strip by
+        strip into .npy files next to the pyramid.
+        '''
+        if self.sat is None:
+            path = os.path.join(self.cache_dir, f'{self.key}-sat')
+            # only for precision, and the same in every session
+            offset = float(np.nan_to_num(np.nanmean(np.asarray(self.levels[-1]))))
+            self.sat = SummedAreaTable(self.arr, path=path, offset=offset)
+            self.files.extend(self.sat.paths)
+        return self.sat
+
+    def drop_sat(self):
+        if self.sat is not None:
+            paths, self.sat = self.sat.paths, None
+        else:
+            paths = [os.path.join(self.cache_dir, f'{self.key}-sat-{name}.npy') for name in ('s', 's2')]
+        _remove_files(paths)
+
+    def update(self, region=None):
+        '''
+        Recomputes every level of the pyramid over region = (y0, y1, x0, x1)
+        (full resolution coordinates, the whole array if None) after the array
+        has been changed in place, and drops the tiles covering it. The summed
+        area table is deleted and rebuilt on the next use.
+        '''
+        self.drop_sat()
+        h, w = self.shape
+        y0, y1, x0, x1 = region if region is not None else (0, h, 0, w)
+        y0, x0 = max(int(y0), 0), max(int(x0), 0)
+        y1, x1 = min(ceil(y1), h), min(ceil(x1), w)
+        t = self.tile
+        for j in range(len(self.levels)):
+            f = 2**j
+            lh, lw = self.levels[j].shape[:2]
+            r0, r1 = y0 // f, min(-(-y1 // f), lh)
+            c0, c1 = x0 // f, min(-(-x1 // f), lw)
+            if r1 <= r0 or c1 <= c0:
+                break
+            if j > 0:
+                dst = np.load(self.paths[j], mmap_mode='r+')
+                self.fill(self.levels[j-1], dst, r0, r1, c0, c1)
+                dst.flush()
+                del dst
+            ty0, ty1, tx0, tx1 = r0 // t, -(-r1 // t), c0 // t, -(-c1 // t)
+            self.tiles.invalidate(lambda key: key[0] == j and ty0 <= key[1] < ty1 and tx0 <= key[2] < tx1)
+
+    def level_for(self, scale):
+        # scale: image pixels per screen pixel
+        j = int(np.floor(np.log2(max(scale, 1.))))
+        return min(j, len(self.levels)-1)
+
+    def get_tile(self, j, ty, tx):
+        key = (j, ty, tx)
+        tile = self.tiles.get(key)
+        if tile is None:
+            t = self.tile
+            tile = np.asarray(self.levels[j][ty*t:(ty+1)*t, tx*t:(tx+1)*t])
+            self.tiles.put(key, tile)
+        return tile
+
+    def region(self, x0, y0, x1, y1, scale):
+        '''
+        Mosaic of the tiles covering [y0:y1, x0:x1] (full resolution coordinates)
+        at the level matching scale, and its rect in full resolution coordinates.
+        '''
+        j = self.level_for(scale)
+        level, t, f = self.levels[j], self.tile, 2**j
+        h, w = level.shape[:2]
+        ty0, ty1 = max(int(y0) // f // t, 0), min(-(-int(np.ceil(y1)) // f // t), -(-h // t))
+        tx0, tx1 = max(int(x0) // f // t, 0), min(-(-int(np.ceil(x1)) // f // t), -(-w // t))
+        if ty1 <= ty0 or tx1 <= tx0:
+            return None, None
+        rows = [np.concatenate([self.get_tile(j, ty, tx) for tx in range(tx0, tx1)], axis=1)
+                for ty in range(ty0, ty1)]
+        mosaic = np.concatenate(rows, axis=0)
+        rect = QRectF(tx0*t*f, ty0*t*f, mosaic.shape[1]*f, mosaic.shape[0]*f)
+        return mosaic, rect
+
+
+class SummedAreaTable:
+    '''
+    Prefix sums of an image and of its square (taken relative to the image mean
+    for precision): s[i, j] = sum of arr[:i, :j]. Sums over any band of rows or
+    columns or any rectangle then cost O(1) per output value.
+
+    With a path, the tables are built strip by strip into path-s.npy and
+    path-s2.npy (reused if they exist) and memory-mapped, for images that do
+    not fit in memory; offset should then be given.
+    '''
+    def __init__(self, arr, path=None, offset=None, strip=256):
+        h, w = arr.shape[:2]
+        self.shape = (h, w)
+        self.paths = []
+        if path is None:
+            a = np.asarray(arr, dtype=np.float64)
+            self.offset = float(np.nanmean(a)) if offset is None else offset
+            a = np.nan_to_num(a - self.offset)
+            self.s = np.zeros((h+1, w+1))
+            self.s2 = np.zeros((h+1, w+1))
+            np.cumsum(np.cumsum(a, axis=0), axis=1, out=self.s[1:, 1:])
+            np.cumsum(np.cumsum(a*a, axis=0), axis=1, out=self.s2[1:, 1:])
+            return
+        self.offset = offset or 0.
+        self.paths = [path + '-s.npy', path + '-s2.npy']
+        if not all(os.path.exists(p) for p in self.paths):
+            self.build(arr, strip)
+        self.s, self.s2 = [np.load(p, mmap_mode='r') for p in self.paths]
+
+    def build(self, arr, strip):
+        h, w = self.shape
+        tmps = [p + '.tmp' for p in self.paths]
+        s, s2 = [np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64, shape=(h+1, w+1))
+                 for tmp in tmps]
+        s[0] = s2[0] = 0
+        carry, carry2 = np.zeros(w), np.zeros(w)
+        for r in range(0, h, strip):
+            r1 = min(r+strip, h)
+            a = np.nan_to_num(np.asarray(arr[r:r1], dtype=np.float64) - self.offset)
+            rows = np.cumsum(np.cumsum(a, axis=1), axis=0) + carry
+            rows2 = np.cumsum(np.cumsum(a*a, axis=1), axis=0) + carry2
+            s[r+1:r1+1, 0] = s2[r+1:r1+1, 0] = 0
+            s[r+1:r1+1, 1:] = rows
+            s2[r+1:r1+1, 1:] = rows2
+            carry, carry2 = rows[-1], rows2[-1]
+        for t, tmp, path in ((s, tmps[0], self.paths[0]), (s2, tmps[1], self.paths[1])):
+            t.flush()
+            del t
+            os.replace(tmp, path)
+
+    def row_band(self, y0, y1):
+        '''
+        Mean of rows y0..y1-1 for every column.
+        '''
+        s = self.s
+        cols = np.diff(s[y1]) - np.diff(s[y0])
+        return cols / (y1-y0) + self.offset
+
+    def col_band(self, x0, x1):
+        '''
+        Mean of columns x0..x1-1 for every row.
+        '''
+        s = self.s
+        rows = np.diff(s[:, x1]) - np.diff(s[:, x0])
+        return rows / (x1-x0) + self.offset
+
+    def rect(self, table, y0, y1, x0, x1):
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    def stats(self, y0, y1, x0, x1):
+        n = (y1-y0) * (x1-x0)
+        if n <= 0:
+            return None
+        m = self.rect(self.s, y0, y1, x0, x1) / n
+        var = self.rect(self.s2, y0, y1, x0, x1) / n - m*m
+        return {
+            'n': n,
+            'sum': (m + self.offset) * n,
+            'mean': m + self.offset,
+            'std': np.sqrt(max(var, 0.)),
+        }
+
+
+class ImageHistogram:
+    '''
+    Histogram of a 2D array estimated from a strided subsample of about `sample`
+    pixels. The counts are kept per block of block x block sampled pixels, so
+    that an in-place change of a region only recounts the blocks it touches.
+    Percentiles (and so the levels) are read off the cumulative counts.
+    '''
+    def __init__(self, arr, nbins=256, sample=2**20, block=128):
+        self.arr = arr
+        self.nbins = nbins
+        h, w = arr.shape[:2]
+        self.step = max(1, ceil(np.sqrt(h*w / sample)))
+        self.block = block
+        self.shape = (-(-h // (block*self.step)), -(-w // (block*self.step)))    # blocks
+        self.nrebuilds = 0
+        self.build()
+
+    def sample(self, by0, by1, bx0, bx1):
+        s, b = self.step, self.block*self.step
+        return np.asarray(self.arr[by0*b:by1*b:s, bx0*b:bx1*b:s], dtype=np.float64)
+
+    def build(self):
+        ny, nx = self.shape
+        v = self.sample(0, ny, 0, nx)
+        finite = v[np.isfinite(v)]
+        lo, hi = (float(finite.min()), float(finite.max())) if finite.size else (0., 1.)
+        if hi <= lo:
+            hi = lo + 1.
+        self.edges = np.linspace(lo, hi, self.nbins+1)
+        self.counts = self.count(v, ny, nx)
+        self.total = self.counts.sum(axis=(0, 1))
+        self.nrebuilds += 1
+
+    def count(self, v, ny, nx):
+        # counts of every block of v (sampled pixels), shape (ny, nx, nbins)
+        lo, hi = self.edges[0], self.edges[-1]
+        rows, cols = np.indices(v.shape, sparse=True)
+        block = (rows // self.block) * nx + cols // self.block
+        finite = np.isfinite(v)
+        idx = np.clip(((v[finite] - lo) / (hi - lo) * self.nbins).astype(np.intp), 0, self.nbins-1)
+        flat = np.broadcast_to(block, v.shape)[finite] * self.nbins + idx
+        return np.bincount(flat, minlength=ny*nx*self.nbins).reshape(ny, nx, self.nbins)
+
+    def update(self, region=None):
+        '''
+        Recounts the blocks covering region = (y0, y1, x0, x1) in array
+        coordinates, the whole array if None. Values outside of the current
+        bins trigger a rebuild with the new range.
+        '''
+        if region is None:
+            self.build()
+            return
+        y0, y1, x0, x1 = region
+        b = self.block*self.step
+        by0, bx0 = max(int(y0) // b, 0), max(int(x0) // b, 0)
+        by1, bx1 = min(-(-int(y1) // b), self.shape[0]), min(-(-int(x1) // b), self.shape[1])
+        if by1 <= by0 or bx1 <= bx0:
+            return
+        v = self.sample(by0, by1, bx0, bx1)
+        finite = v[np.isfinite(v)]
+        if finite.size and (finite.min() < self.edges[0] or finite.max() > self.edges[-1]):
+            self.build()
+            return
+        counts = self.count(v, by1-by0, bx1-bx0)
+        self.total += counts.sum(axis=(0, 1)) - self.counts[by0:by1, bx0:bx1].sum(axis=(0, 1))
+        self.counts[by0:by1, bx0:bx1] = counts
+
+    def get(self):
+        # bin centers and counts, as returned by pg.ImageItem.getHistogram
+        return (self.edges[:-1] + self.edges[1:]) / 2, self.total
+
+    def percentile(self, q):
+        cdf = np.concatenate([[0.], np.cumsum(self.total)])
+        if cdf[-1] == 0:
+            return float(self.edges[0] if q < 50 else self.edges[-1])
+        return float(np.interp(q/100 * cdf[-1], cdf, self.edges))
+
+    def levels(self, lo=0.5, hi=99.5):
+        vmin, vmax = self.percentile(lo), self.percentile(hi)
+        if vmax <= vmin:
+            vmin, vmax = float(self.edges[0]), float(self.edges[-1])
+        return vmin, vmax
+
+
+class StackSlices:
+    '''
+    2D slices of an N-D array (np.memmap or anything that supports indexing of
+    the leading axes) and their histograms, read into memory on first use and
+    kept in an LRU cache limited to max_bytes. Safe to fill from another thread.
+    '''
+    def __init__(self, arr, max_bytes=512*2**20, histogram_sample=2**20):
+        self.arr = arr
+        self.shape = tuple(arr.shape[:-2])
+        self.cache = LRUCache(max_bytes)
+        self.histogram_sample = histogram_sample
+        self.nloaded = 0
+
+    def load(self, index):
+        image = self.arr[index]
+        if isinstance(image, np.memmap) or not isinstance(image, np.ndarray):
+            image = np.array(image)        # read it now rather than on the first access
+        self.nloaded += 1
+        return image, ImageHistogram(image, sample=self.histogram_sample)
+
+    def get(self, index):
+        item = self.cache.get(index)
+        if item is None:
+            item = self.load(index)
+            self.cache.put(index, item)
+        return item
+
+    def fill(self, index):
+        if index in self.cache:
+            return False
+        self.cache.put(index, self.load(index))
+        return True
+
+
+class SlicePrefetcher(QObject):
+    '''
+    Loads the slices next to the current one along the most recently moved axis
+    into the StackSlices cache in a background thread: `radius` slices ahead in
+    the direction of the movement, then one behind. A new move cancels the rest.
+    '''
+    def __init__(self, slices, radius=4, parent=None):
+        super().__init__(parent)
+        self.slices = slices
+        self.radius = radius
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qtinteract-slices')
+        self.generation = 0
+        self.futures = []
+        self.last = None
+        self.direction = 1
+        self.nprefetched = 0
+        self.ncancelled = 0
+
+    def moved(self, index, axis):
+        self.cancel()
+        if self.last is not None and index[axis] != self.last[axis]:
+            self.direction = 1 if index[axis] > self.last[axis] else -1
+        self.last = index
+        n = self.slices.shape[axis]
+        indices = []
+        for d in list(range(1, self.radius+1)) + [-1]:
+            k = index[axis] + d*self.direction
+            if 0 <= k < n:
+                indices.append(index[:axis] + (k,) + index[axis+1:])
+        self.futures.append(self.pool.submit(self.run, self.generation, indices))
+
+    def cancel(self):
+        self.generation += 1
+        for future in self.futures:
+            if future.cancel():
+                self.ncancelled += 1
+        self.futures = []
+
+    def run(self, generation, indices):
+        try:
+            for index in indices:
+                if generation != self.generation:
+                    return
+                if self.slices.fill(index):
+                    self.nprefetched += 1
+        except:
+            print_exc()
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'prefetched': self.nprefetched,
+            'cancelled': self.ncancelled,
+            'loaded': self.slices.nloaded,
+            'cache': self.slices.cache.stats(),
+        }
+
+
 class IShow(QWidget):
+    tile_threshold = 4096*4096    # images with more pixels are rendered through a TiledImage
+    tile_cache_dir = None
+    tile_disk_bytes = 4*2**30     # pyramids of memmaps kept in tile_cache_dir
+    draft_quality = True   # no antialiasing while the lines are dragged
+    perf_size = 1000       # number of updates kept by the latency monitor
+    histogram_sample = 2**20         # pixels sampled for the histogram and the levels
+    level_percentiles = (0.5, 99.5)  # auto levels
+    stack_cache_bytes = 512*2**20    # slices of N-D arrays kept in memory
+    stack_prefetch = 4               # slices loaded ahead along the moved axis, 0 to disable
+
     def __init__(self, arr=None):
+        setup()
         super().__init__()#parent=parent)
 
         self.setGeometry(300, 300, 400, 300)
@@ -430,9 +3068,28 @@ class IShow(QWidget):
 #        self.layout = QVBoxLayout(self)
         self.canvas0 = pg.PlotWidget()
         self.canvas0.addLegend()
-        self.image = arr
-        self.im = pg.ImageItem(self.image)
+        self.tiled = None
+        self.stack = None
+        self.prefetcher = None
+        if arr.ndim > 2:      # (..., y, x): a slider for every leading axis
+            self.stack = StackSlices(arr, max_bytes=self.stack_cache_bytes,
+                                     histogram_sample=self.histogram_sample)
+            self.stack_index = (0,) * (arr.ndim-2)
+            self.image, self.histogram = self.stack.get(self.stack_index)
+            if self.stack_prefetch:
+                self.prefetcher = SlicePrefetcher(self.stack, radius=self.stack_prefetch, parent=self)
+        else:
+            self.image = arr
+            self.histogram = ImageHistogram(arr, sample=self.histogram_sample)
+        self.levels = self.histogram.levels(*self.level_percentiles)
+        if self.stack is None and np.prod(arr.shape) > self.tile_threshold:
+            self.tiled = TiledImage(arr, cache_dir=self.tile_cache_dir, disk_bytes=self.tile_disk_bytes)
+            self.im = pg.ImageItem()
+        else:
+            self.im = pg.ImageItem(self.image, levels=self.levels)
         self.im.setColorMap(pg.colormap.get('viridis'))
+        self.im.getHistogram = self.get_histogram    # the cached estimate instead of a pass over the image
+        self.lut = None
 #        self.im.hoverEvent = self.update_profile
         self.canvas0.addItem(self.im)
 #        self.layout.addWidget(self.canvas0)
@@ -440,10 +3097,14 @@ class IShow(QWidget):
         self.vline = VLine(pos=self.image.shape[1]//2, bounds=(0, self.image.shape[1]), on_drag=self.update_profile)
         self.canvas0.addItem(self.hline)
         self.canvas0.addItem(self.vline)
+        self.draft_styles = None
+        self.hline.sigPositionChangeFinished.connect(self.drag_finished)
+        self.vline.sigPositionChangeFinished.connect(self.drag_finished)
 
 #        self.tabs = QTabWidget()
 
         self.canvas_below = pg.PlotWidget()
+        self.perf = PerfMonitor(self.canvas_below, size=self.perf_size, parent=self)
         self.p_below = self.canvas_below.plot([], pen='b', name='p0')
 #        self.tabs.addTab(self.canvas1, 'horizontal')
         self.vline_below = VLine(pos=self.image.shape[1]//2, bounds=(0, self.image.shape[1]), 
@@ -460,35 +3121,248 @@ class IShow(QWidget):
         self.canvas_right.addItem(self.hline_right)
         self.canvas_right.setYLink(self.canvas0)
 
+        self.band = 1
+        self.sat = None
+        self.roi = None
+        self.band_spinbox = QSpinBox()
+        self.band_spinbox.setRange(1, max(self.image.shape[:2]))
+        self.band_spinbox.valueChanged['int'].connect(self.set_band) # type: ignore
+        self.roi_checkbox = QCheckBox('ROI')
+        self.roi_checkbox.toggled.connect(self.roi_toggled)
+        self.roi_label = QLabel()
+        self.levels_checkbox = QCheckBox('levels')
+        self.levels_checkbox.toggled.connect(self.levels_toggled)
+        self.auto_levels_button = QPushButton('auto levels')
+        self.auto_levels_button.clicked.connect(self.auto_levels)
+
+        self.axis_sliders = []
+        self.axis_labels = []
+        axis_rows = []
+        for axis, n in enumerate(self.stack.shape if self.stack is not None else ()):
+            slider = QSlider()
+            slider.setOrientation(Qt.Horizontal)
+            slider.setRange(0, n-1)
+            def wrapped(k, axis=axis):
+                self.axis_changed(axis, k)
+            slider.valueChanged['int'].connect(wrapped) # type: ignore
+            label = QLabel(f'0/{n-1}')
+            self.axis_sliders.append(slider)
+            self.axis_labels.append(label)
+            axis_rows.append(hStack(QLabel(f'axis {axis}:'), slider, label))
+
+        self.top_row = hStack(self.canvas0, self.canvas_right, ratio=(4,1))
         self.layout = vStack(
-                hStack(self.canvas0, self.canvas_right, ratio=(4,1)), 
+                self.top_row,
                 hStack(self.canvas_below, None, ratio=(4,1)),
+                *axis_rows,
+                hStack(QLabel('band:'), self.band_spinbox, self.roi_checkbox, self.roi_label, None,
+                       self.levels_checkbox, self.auto_levels_button),
             parent=self,
-            ratio=(4,1),
+            ratio=(4,1) + (0,)*(len(axis_rows)+1),
         )
+        if self.tiled is not None:
+            self.tile_timer = QTimer(self)
+            self.tile_timer.setSingleShot(True)
+            self.tile_timer.timeout.connect(self.update_tiles)
+            vb = self.canvas0.getViewBox()
+            vb.setRange(QRectF(0, 0, self.image.shape[1], self.image.shape[0]), padding=0)
+            vb.disableAutoRange()
+            vb.sigRangeChanged.connect(self.tile_timer.start)
+            vb.sigResized.connect(self.tile_timer.start)
+            self.update_tiles()
+        self.update_profile()
+
+    def update_tiles(self):
+        try:
+            vb = self.canvas0.getViewBox()
+            (x0, x1), (y0, y1) = vb.viewRange()
+            width, height = max(vb.width(), 1), max(vb.height(), 1)
+            scale = min((x1-x0)/width, (y1-y0)/height)
+            mosaic, rect = self.tiled.region(x0, y0, x1, y1, scale)
+            if mosaic is not None:
+                self.im.setImage(mosaic, autoLevels=False, levels=self.levels)
+                self.im.setRect(rect)
+        except:
+            print_exc()
+
+    def axis_changed(self, axis, k):
+        try:
+            self.perf.event_received()
+            self.set_index(self.stack_index[:axis] + (k,) + self.stack_index[axis+1:], axis)
+        except:
+            print_exc()
+
+    def set_index(self, index, axis=None):
+        '''
+        Shows the slice stack[index] of an N-D array; axis is the one that was
+        moved, where the neighbouring slices are prefetched.
+        '''
+        index = tuple(int(k) for k in index)
+        self.stack_index = index
+        for slider, label, k in zip(self.axis_sliders, self.axis_labels, index):
+            if slider.value() != k:
+                set_value_nc(slider, k)
+            label.setText(f'{k}/{slider.maximum()}')
+        self.image, self.histogram = self.stack.get(index)
+        self.sat = None
+        self.im.setImage(self.image, autoLevels=False)
+        self.update_profile()
+        self.update_roi()
+        if self.prefetcher is not None and axis is not None:
+            self.prefetcher.moved(index, axis)
+
+    def get_histogram(self, *args, **kwargs):
+        return self.histogram.get()
+
+    def levels_toggled(self, checked):
+        try:
+            if checked and self.lut is None:
+                self.lut = pg.HistogramLUTWidget()
+                self.lut.item.gradient.setColorMap(pg.colormap.get('viridis'))
+                self.lut.item.setImageItem(self.im)
+                self.lut.item.setLevels(*self.levels)
+                self.lut.item.sigLevelsChanged.connect(self.levels_changed)
+                self.top_row.addWidget(self.lut)
+            if self.lut is not None:
+                self.lut.setVisible(checked)
+        except:
+            print_exc()
+
+    def levels_changed(self, item):
+        self.levels = tuple(item.getLevels())
+
+    def set_levels(self, vmin, vmax):
+        self.levels = (vmin, vmax)
+        if self.lut is not None:
+            self.lut.item.setLevels(vmin, vmax)
+        else:
+            self.im.setLevels(self.levels)
+
+    def auto_levels(self):
+        self.set_levels(*self.histogram.levels(*self.level_percentiles))
+
+    def image_changed(self, region=None):
+        '''
+        To be called after self.image has been modified in place; region is
+        (y0, y1, x0, x1) of the modified pixels, None for the whole image.
+        '''
+        try:
+            self.histogram.update(region)
+            self.sat = None
+            if self.tiled is not None:
+                self.tiled.update(region)
+                self.update_tiles()
+            else:
+                self.im.setImage(self.image, autoLevels=False)
+            self.update_profile()
+            self.update_roi()
+        except:
+            print_exc()
+
+    def get_sat(self):
+        if self.sat is None:
+            if self.tiled is None:
+                self.sat = SummedAreaTable(self.image)
+            else:        # on disk, next to the pyramid
+                self.sat = self.tiled.summed_area_table()
+        return self.sat
+
+    def set_band(self, band):
+        self.band = max(int(band), 1)
+        if self.band_spinbox.value() != self.band:
+            set_value_nc(self.band_spinbox, self.band)
         self.update_profile()
 
+    def band_range(self, i, n):
+        i0 = min(max(i - self.band//2, 0), max(n - self.band, 0))
+        return i0, min(i0 + self.band, n)
+
+    def row_profile(self, y):
+        if self.band == 1:
+            return np.asarray(self.image[y, :])
+        y0, y1 = self.band_range(y, self.image.shape[0])
+        return self.get_sat().row_band(y0, y1)
+
+    def col_profile(self, x):
+        if self.band == 1:
+            return np.asarray(self.image[:, x])
+        x0, x1 = self.band_range(x, self.image.shape[1])
+        return self.get_sat().col_band(x0, x1)
+
+    def roi_toggled(self, checked):
+        try:
+            if checked and self.roi is None:
+                h, w = self.image.shape[:2]
+                self.roi = pg.RectROI([w//4, h//4], [w//2, h//2], pen='r')
+                self.roi.sigRegionChanged.connect(self.update_roi)
+                self.canvas0.addItem(self.roi)
+            if self.roi is not None:
+                self.roi.setVisible(checked)
+            self.update_roi()
+        except:
+            print_exc()
+
+    def roi_stats(self):
+        if self.roi is None or not self.roi.isVisible():
+            return None
+        h, w = self.image.shape[:2]
+        (x0, y0), (dx, dy) = self.roi.pos(), self.roi.size()
+        x0, x1 = [min(max(round(v), 0), w) for v in (x0, x0+dx)]
+        y0, y1 = [min(max(round(v), 0), h) for v in (y0, y0+dy)]
+        return self.get_sat().stats(y0, y1, x0, x1)
+
+    def update_roi(self):
+        try:
+            st = self.roi_stats()
+            if st is None:
+                self.roi_label.setText('')
+            else:
+                self.roi_label.setText(f'n={st["n"]}  sum={st["sum"]:.6g}  mean={st["mean"]:.6g}  std={st["std"]:.6g}')
+        except:
+            print_exc()
+
+    def show_hud(self, on=True):
+        self.perf.show_hud(on)
+
+    def closeEvent(self, event):
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+        self.perf.close()
+        super().closeEvent(event)
+
     def vline_below_dragged(self, obj):
         pass
 
     def hline_right_dragged(self, obj):
         pass
 
+    def drag_finished(self, line):
+        if self.draft_styles is not None:
+            restore_style(self.draft_styles)
+            self.draft_styles = None
+
     def update_profile(self, event=None):
         try:
+            if event is not None and self.draft_quality and self.draft_styles is None:
+                self.draft_styles = set_draft_style([self.p_below, self.p_right])
             y, x = round(self.hline.pos().y()), round(self.vline.pos().x())
 #             image_pos = self.im.mapFromScene(self.hline.pos().y(), self.vline.pos().x())
 #             print(image_pos)
 #             x, y = round(image_pos.y()), round(image_pos.x())
+            rec = self.perf.begin()
             y = max(y, 0)
             y = min(y, self.image.shape[0]-1)
-            self.p_below.setData(self.image[y, :])
-            self.hline_right.setPos(y)
-
             x = max(x, 0)
             x = min(x, self.image.shape[1]-1)
-            self.p_right.setData(self.image[:, x], np.arange(len(self.image)))
+            rec['t_eval_start'] = perf_counter()
+            row, col = self.row_profile(y), self.col_profile(x)
+            rec['t_eval_end'] = perf_counter()
+
+            self.p_below.setData(row)
+            self.hline_right.setPos(y)
+            self.p_right.setData(col, np.arange(self.image.shape[0]))
             self.vline_below.setPos(x)
+            self.perf.set_data_done()
         except:
             print_exc()
             raise
@@ -14,7 +14,7 @@ setuptools.setup(
     description='Fast interactive plots in Jupyter Notebooks using Qt Widgets',
     long_description=long_description,
     long_description_content_type='text/markdown',
-    python_requires=">=3.7",
+    python_requires=">=3.9",
     install_requires=[
         'pyqt5',
         'pyqtgraph',
@@ -24,8 +24,6 @@ setuptools.setup(
         'Development Status :: 4 - Beta',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 3.7',
-        'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',    
         'Programming Language :: Python :: 3.10',    
         'Programming Language :: Python :: 3.11',    
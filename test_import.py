@@ -0,0 +1,50 @@
+'''
+Checks that `import qtinteract` stays cheap and free of side effects:
+
+    python -m pytest test_import.py
+
+The budget (seconds on top of PyQt5 and pyqtgraph) can be changed with the
+QTINTERACT_IMPORT_BUDGET environment variable.
+'''
+import os
+import sys
+import json
+import subprocess
+
+IMPORT_BUDGET = float(os.environ.get('QTINTERACT_IMPORT_BUDGET', 0.05))
+
+IMPORT_SCRIPT = '''
+import sys, json
+from time import perf_counter
+import PyQt5.QtWidgets, pyqtgraph
+config = dict(pyqtgraph.CONFIG_OPTIONS)
+t0 = perf_counter()
+import qtinteract
+t1 = perf_counter()
+print(json.dumps({'seconds': t1 - t0, 'scipy': 'scipy' in sys.modules,
+                  'config_changed': dict(pyqtgraph.CONFIG_OPTIONS) != config}))
+'''
+
+
+def measure_import(repeat=5):
+    '''
+    Imports qtinteract in repeat fresh interpreters; returns the fastest import
+    time and whether any of them loaded scipy or changed the pyqtgraph config.
+    '''
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    runs = [json.loads(subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=cwd, check=True,
+                                      capture_output=True, text=True).stdout)
+            for _ in range(repeat)]
+    return {
+        'seconds': min(r['seconds'] for r in runs),
+        'scipy': any(r['scipy'] for r in runs),
+        'config_changed': any(r['config_changed'] for r in runs),
+    }
+
+
+def test_import():
+    r = measure_import()
+    assert r['seconds'] <= IMPORT_BUDGET, \
+        f'import takes {r["seconds"]*1e3:.1f} ms, the budget is {IMPORT_BUDGET*1e3:.1f} ms'
+    assert not r['scipy'], 'scipy is imported at import time'
+    assert not r['config_changed'], 'pyqtgraph config is changed at import time'